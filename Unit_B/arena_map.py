@@ -0,0 +1,238 @@
+# Maps of walls, consisting of line segments, e.g. the polygon(s) of a
+# floor plan. Unlike get_corresponding_points_on_wall in slam_05_a, which
+# knows only the four walls of the 2000 x 2000 mm arena, a SegmentMap may
+# contain any number of walls in any direction.
+# To find the closest wall point for many scan points quickly, the segments
+# are registered in a uniform grid. For every max_distance used in queries,
+# a second (finer) grid is derived from it, which lists for each cell the
+# segments that may be closer than max_distance to any point of the cell.
+# A query then only looks at the segments listed for the cell of each point,
+# and all points of a scan are processed at once, with array operations.
+import numpy as np
+
+
+class SegmentMap(object):
+    """A map consisting of line segments, given as an (m, 2, 2) array of
+       (start point, end point) pairs. cell_size is the size of the grid
+       cells used to index the segments (in mm). If it is not given, it is
+       chosen so that there is about one segment per cell.
+       Segments of length zero (e.g. from a polygon whose first vertex is
+       repeated at the end) are removed."""
+    def __init__(self, segments, cell_size = None):
+        segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        d = segments[:, 1, :] - segments[:, 0, :]
+        segments = segments[np.sum(d * d, axis=1) > 0.0]
+        self.segments = segments
+        self.start = segments[:, 0, :]
+        self.direction = segments[:, 1, :] - segments[:, 0, :]
+        self.length2 = np.sum(self.direction * self.direction, axis=1)
+        # Unit normals of the segments (direction rotated by 90 degrees).
+        self.normals = np.column_stack(
+            (-self.direction[:, 1], self.direction[:, 0])) / \
+            np.sqrt(self.length2)[:, np.newaxis]
+
+        lower = np.min(segments.reshape(-1, 2), axis=0)
+        upper = np.max(segments.reshape(-1, 2), axis=0)
+        if cell_size is None:
+            cell_size = max(upper - lower) / max(1.0, np.sqrt(len(segments)))
+        self.cell_size = float(cell_size)
+        self.lower, self.upper = lower, upper
+        self.build_grid(lower, upper)
+        # Grids of the segments within reach, by max_distance.
+        self.reach_grids = {}
+
+    @staticmethod
+    def from_polygons(polygons, closed = True, cell_size = None):
+        """Returns the map of the walls of all polygons, each given as a list
+           of (x, y) vertices. If closed is True, the last vertex is
+           connected to the first."""
+        segments = []
+        for polygon in polygons:
+            n = len(polygon)
+            for i in xrange(n if closed else n - 1):
+                segments.append((polygon[i], polygon[(i + 1) % n]))
+        return SegmentMap(segments, cell_size)
+
+    @staticmethod
+    def arena(arena_left = 0.0, arena_right = 2000.0,
+              arena_bottom = 0.0, arena_top = 2000.0):
+        """Returns the map of the four walls of a rectangular arena."""
+        return SegmentMap.from_polygons(
+            [[(arena_left, arena_bottom), (arena_right, arena_bottom),
+              (arena_right, arena_top), (arena_left, arena_top)]])
+
+    def build_grid(self, lower, upper):
+        # The grid covers all segments, with a margin of one cell.
+        self.origin = lower - self.cell_size
+        self.grid_shape = tuple(
+            (np.floor((upper - self.origin) / self.cell_size) + 2).astype(int))
+        # Sample every segment at a spacing of (at most) half a cell and
+        # register it in the cells of all samples. A segment point is then
+        # at most a quarter cell away from a sample in a registered cell.
+        self.sample_spacing = self.cell_size / 2.0
+        lengths = np.sqrt(self.length2)
+        counts = np.ceil(lengths / self.sample_spacing).astype(int) + 1
+        segment_of_sample = np.repeat(np.arange(len(lengths)), counts)
+        first = np.cumsum(counts) - counts
+        k = np.arange(counts.sum()) - np.repeat(first, counts)
+        t = k / np.maximum(counts - 1, 1).astype(float)[segment_of_sample]
+        samples = self.start[segment_of_sample] + \
+            t[:, np.newaxis] * self.direction[segment_of_sample]
+        cells = self.cell_index(
+            np.floor((samples - self.origin) / self.cell_size).astype(int))
+        # Unique (cell, segment) pairs, sorted by cell.
+        keys = np.unique(cells * len(lengths) + segment_of_sample)
+        cells, self.cell_segments = np.divmod(keys, len(lengths))
+        # Segments of cell i are cell_segments[cell_start[i]:cell_start[i+1]].
+        self.cell_start = np.searchsorted(
+            cells, np.arange(self.grid_shape[0] * self.grid_shape[1] + 1))
+
+    def cell_index(self, cell_xy):
+        return cell_xy[..., 0] * self.grid_shape[1] + cell_xy[..., 1]
+
+    def neighbour_cell_pairs(self, points, max_distance):
+        """Returns two arrays (point_indices, segment_indices), which contain
+           (at least) all pairs of points and segments that are closer than
+           max_distance, from all cells around the points. A pair may be
+           contained more than once."""
+        pad = max_distance + self.sample_spacing / 2.0
+        shape = np.array(self.grid_shape)
+        lo = np.floor((points - pad - self.origin) / self.cell_size).astype(int)
+        hi = np.floor((points + pad - self.origin) / self.cell_size).astype(int)
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, shape - 1)
+        width = np.maximum(hi - lo + 1, 0)
+        cells_per_point = width[:, 0] * width[:, 1]
+
+        # All (point, cell) pairs.
+        point_of_cell = np.repeat(np.arange(len(points)), cells_per_point)
+        first = np.cumsum(cells_per_point) - cells_per_point
+        k = np.arange(cells_per_point.sum()) - \
+            np.repeat(first, cells_per_point)
+        cx = lo[point_of_cell, 0] + k // width[point_of_cell, 1]
+        cy = lo[point_of_cell, 1] + k % width[point_of_cell, 1]
+        cells = cx * self.grid_shape[1] + cy
+
+        # All (point, segment) pairs.
+        begin = self.cell_start[cells]
+        segments_per_cell = self.cell_start[cells + 1] - begin
+        point_indices = np.repeat(point_of_cell, segments_per_cell)
+        first = np.cumsum(segments_per_cell) - segments_per_cell
+        k = np.arange(segments_per_cell.sum()) - \
+            np.repeat(first - begin, segments_per_cell)
+        return point_indices, self.cell_segments[k]
+
+    def reach_grid(self, max_distance):
+        """Returns the grid (origin, cell_size, shape, cell_start,
+           cell_segments) in which the segments of cell i, i.e.
+           cell_segments[cell_start[i]:cell_start[i+1]], are all segments
+           closer than max_distance to some point of the cell. The grid
+           covers everything closer than max_distance to a segment. It is
+           computed once per max_distance."""
+        if max_distance in self.reach_grids:
+            return self.reach_grids[max_distance]
+        # Small cells list fewer segments which are out of reach, but there
+        # should not be too many of them.
+        extent = max(self.upper - self.lower) + 2 * max_distance
+        cell_size = max(min(self.cell_size, max_distance / 2.0),
+                        extent / 1000.0)
+        origin = self.lower - max_distance - cell_size
+        shape = tuple((np.floor((self.upper + max_distance - origin) /
+                                cell_size) + 2).astype(int))
+        # Segments closer than max_distance to a cell are closer than
+        # max_distance + half the diagonal to its center.
+        reach = max_distance + cell_size / np.sqrt(2.0)
+        cx, cy = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]),
+                             indexing='ij')
+        centers = origin + (np.column_stack((cx.ravel(), cy.ravel())) + 0.5) \
+            * cell_size
+        cells, segments = self.neighbour_cell_pairs(centers, reach)
+        p = centers[cells]
+        a = self.start[segments]
+        d = self.direction[segments]
+        t = np.clip(np.einsum('ij,ij->i', p - a, d) / self.length2[segments],
+                    0.0, 1.0)
+        foot = a + t[:, np.newaxis] * d
+        near = np.einsum('ij,ij->i', p - foot, p - foot) < reach * reach
+        keys = np.unique(cells[near] * len(self.segments) + segments[near])
+        cells, cell_segments = np.divmod(keys, len(self.segments))
+        cell_start = np.searchsorted(cells, np.arange(shape[0] * shape[1] + 1))
+        grid = (origin, cell_size, shape, cell_start, cell_segments)
+        self.reach_grids[max_distance] = grid
+        return grid
+
+    def candidate_pairs(self, points, max_distance):
+        """Returns two arrays (point_indices, segment_indices), which contain
+           (at least) all pairs of points and segments that are closer than
+           max_distance, grouped by point. Every pair is contained at most
+           once."""
+        origin, cell_size, shape, cell_start, cell_segments = \
+            self.reach_grid(max_distance)
+        c = np.floor((points - origin) / cell_size).astype(int)
+        inside = np.flatnonzero((c[:, 0] >= 0) & (c[:, 0] < shape[0]) &
+                                (c[:, 1] >= 0) & (c[:, 1] < shape[1]))
+        cells = c[inside, 0] * shape[1] + c[inside, 1]
+        begin = cell_start[cells]
+        counts = cell_start[cells + 1] - begin
+        point_indices = np.repeat(inside, counts)
+        first = np.cumsum(counts) - counts
+        k = np.arange(counts.sum()) - np.repeat(first - begin, counts)
+        return point_indices, cell_segments[k]
+
+    def closest_points(self, points, max_distance):
+        """For an (n, 2) array of points, returns the (n, 2) array of the
+           closest points on the segments and the (n,) array of distances.
+           If there is no segment within max_distance, the distance is inf
+           (and the closest point is undefined)."""
+        closest, normals, distances = \
+            self.closest_points_and_normals(points, max_distance)
+        return closest, distances
+
+    def closest_points_and_normals(self, points, max_distance):
+        """Same as closest_points, but additionally returns the (n, 2)
+           array of the unit normals of the segments the closest points
+           are on."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(points)
+        closest = np.zeros((n, 2))
+        normals = np.zeros((n, 2))
+        distances = np.inf * np.ones(n)
+        point_indices, segment_indices = \
+            self.candidate_pairs(points, max_distance)
+        if not len(point_indices):
+            return closest, normals, distances
+
+        # Project all candidate points onto their segments.
+        p = np.take(points, point_indices, axis=0)
+        a = np.take(self.start, segment_indices, axis=0)
+        d = np.take(self.direction, segment_indices, axis=0)
+        t = np.einsum('ij,ij->i', p - a, d) / \
+            np.take(self.length2, segment_indices)
+        foot = a + np.clip(t, 0.0, 1.0)[:, np.newaxis] * d
+        dist2 = np.einsum('ij,ij->i', p - foot, p - foot)
+
+        # Keep the closest segment of each point. The pairs are grouped by
+        # point, so the minimum of each group is found without sorting.
+        first = np.flatnonzero(np.diff(point_indices)) + 1
+        first = np.concatenate(([0], first))
+        found = point_indices[first]
+        minima = np.minimum.reduceat(dist2, first)
+        sizes = np.diff(np.append(first, len(dist2)))
+        is_min = np.flatnonzero(dist2 == np.repeat(minima, sizes))
+        best = is_min[np.searchsorted(is_min, first)]
+        closest[found] = foot[best]
+        normals[found] = self.normals[segment_indices[best]]
+        distances[found] = np.sqrt(minima)
+        distances[distances >= max_distance] = np.inf
+        return closest, normals, distances
+
+
+# Generalization of get_corresponding_points_on_wall to a SegmentMap:
+# For every point which is closer than eps to a wall, adds the point to
+# left_list and the closest point on the wall to right_list.
+def get_corresponding_points_on_map(points, segment_map, eps = 150.0):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    closest, distances = segment_map.closest_points(points, eps)
+    valid = np.isfinite(distances)
+    return [tuple(p) for p in points[valid]], \
+           [tuple(p) for p in closest[valid]]
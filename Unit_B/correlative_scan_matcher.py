@@ -0,0 +1,126 @@
+# Correlative scan matching (E. Olson, "Real-Time Correlative Scan
+# Matching", 2009): instead of iterating from an initial guess, as ICP does,
+# all poses in an (x, y, heading) search window around the predicted pose
+# are scored, and the best one is returned. This cannot fall into a local
+# minimum inside the window.
+# The score of a pose is the sum of the lookup table values at the scan
+# points, where the (high resolution) lookup table is exp(-d^2/(2 sigma^2))
+# of the likelihood field. To avoid scoring every pose, a low resolution
+# table is used, which holds the maximum of the high resolution table over a
+# block of block_size x block_size cells. Its score is an upper bound for
+# the scores of all translations in the block, so blocks are expanded in
+# the order of their bound, and the search stops as soon as the bound is
+# not better than the best pose found so far (branch and bound).
+# Translations are searched in steps of the field's resolution, so that a
+# translation is just an offset of the table indices.
+from math import cos, sin, pi
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+
+class CorrelativeScanMatcher(object):
+    """Scan matcher on the given LikelihoodField. sigma is the standard
+       deviation used for the lookup table (in mm), block_size the number
+       of cells of the low resolution table, in each direction."""
+    def __init__(self, likelihood_field, sigma = 50.0, block_size = 8):
+        self.field = likelihood_field
+        self.resolution = likelihood_field.resolution
+        self.origin = likelihood_field.origin
+        self.shape = likelihood_field.shape
+        self.block_size = block_size
+        d = likelihood_field.distances
+        high = np.exp(-0.5 * (d / np.float32(sigma)) ** 2).astype(np.float32)
+        # Zero borders, so that points outside the table (whose indices
+        # are clipped) score nothing. This keeps the bound valid there.
+        high[0, :] = high[-1, :] = high[:, 0] = high[:, -1] = 0.0
+        # low[i, j] = max(high[i:i+block_size, j:j+block_size]).
+        shift = -(block_size // 2)
+        low = maximum_filter(high, size=block_size, mode='constant',
+                             origin=(shift, shift))
+        self.high = high.ravel()
+        self.low = low.ravel()
+
+    def scores(self, table, cells, offsets):
+        """For an (r, n, 2) array of the scan's cell indices, for r
+           rotations, and a (m, 2) array of cell offsets, returns the
+           (r, m) array of scores."""
+        nx, ny = self.shape
+        ix = np.clip(cells[:, np.newaxis, :, 0] +
+                     offsets[np.newaxis, :, np.newaxis, 0], 0, nx - 1)
+        iy = np.clip(cells[:, np.newaxis, :, 1] +
+                     offsets[np.newaxis, :, np.newaxis, 1], 0, ny - 1)
+        return np.sum(table[ix * ny + iy], axis=2)
+
+    def match(self, pose, scanner_points, search_distance = 200.0,
+              search_angle = 10.0 / 180.0 * pi, angle_step = None):
+        """Searches the poses within +-search_distance (in x and y) and
+           +-search_angle (in heading) of pose. scanner_points is an (n, 2)
+           array of scan points, in the scanner's coordinate system.
+           angle_step defaults to the angle which moves the farthest point
+           by one cell.
+           Returns (best_pose, score)."""
+        points = np.asarray(scanner_points, dtype=float).reshape(-1, 2)
+        if angle_step is None:
+            max_range = max(np.max(np.hypot(points[:, 0], points[:, 1])),
+                            self.resolution)
+            angle_step = self.resolution / max_range
+        steps = int(np.ceil(search_angle / angle_step))
+        angles = pose[2] + angle_step * np.arange(-steps, steps + 1)
+
+        # Rotate the scan by all angles at once and convert to (fractional
+        # cell) coordinates, relative to the unshifted pose.
+        c = np.cos(angles)[:, np.newaxis]
+        s = np.sin(angles)[:, np.newaxis]
+        wx = c * points[:, 0] - s * points[:, 1] + pose[0]
+        wy = s * points[:, 0] + c * points[:, 1] + pose[1]
+        cells = np.empty(wx.shape + (2,), dtype=int)
+        cells[:, :, 0] = np.rint((wx - self.origin[0]) / self.resolution)
+        cells[:, :, 1] = np.rint((wy - self.origin[1]) / self.resolution)
+
+        # Score all blocks at low resolution.
+        w = int(np.ceil(search_distance / self.resolution))
+        k = self.block_size
+        starts = np.arange(-w, w + 1, k)
+        block_offsets = np.column_stack(
+            (np.repeat(starts, len(starts)), np.tile(starts, len(starts))))
+        bounds = self.scores(self.low, cells, block_offsets).ravel()
+
+        # Expand blocks in the order of their bounds.
+        fine = np.arange(k)
+        fine_offsets = np.column_stack(
+            (np.repeat(fine, k), np.tile(fine, k)))
+        best_score, best = -1.0, (steps, 0, 0)
+        for b in np.argsort(-bounds, kind='mergesort'):
+            if bounds[b] <= best_score:
+                break
+            r, j = divmod(b, len(block_offsets))
+            offsets = block_offsets[j] + fine_offsets
+            offsets = offsets[np.all(offsets <= w, axis=1)]
+            scores = self.scores(self.high, cells[r:r + 1], offsets)[0]
+            i = np.argmax(scores)
+            if scores[i] > best_score:
+                best_score = scores[i]
+                best = (r, offsets[i, 0], offsets[i, 1])
+
+        r, dx, dy = best
+        best_pose = (pose[0] + dx * self.resolution,
+                     pose[1] + dy * self.resolution,
+                     angles[r])
+        return best_pose, float(best_score)
+
+
+# Returns the transform which takes pose to the matched pose, in the form
+# (1.0, cos(angle), sin(angle), x_translation, y_translation), so that
+# correct_pose(pose, trafo) yields the matched pose. May be used in place
+# of get_icp_transform, but needs the scan points in the scanner's
+# coordinate system instead of the world points.
+def get_correlative_transform(pose, scanner_points, matcher,
+                              search_distance = 200.0,
+                              search_angle = 10.0 / 180.0 * pi):
+    new_pose, score = matcher.match(pose, scanner_points,
+                                    search_distance, search_angle)
+    angle = new_pose[2] - pose[2]
+    c, s = cos(angle), sin(angle)
+    tx = new_pose[0] - (c * pose[0] - s * pose[1])
+    ty = new_pose[1] - (s * pose[0] + c * pose[1])
+    return (1.0, c, s, tx, ty)
@@ -0,0 +1,232 @@
+# ICP (iterative closest point) for 2D scans, against a general reference:
+# either a point cloud or a map of line segments (e.g. walls).
+# Unlike get_icp_transform in slam_05_c, which uses a fixed number of
+# iterations and knows only the four walls of the arena, the iteration
+# stops as soon as the transform increment or the change of the residual
+# becomes small.
+#
+# Besides the point-to-point variant (icp), there is a point-to-line
+# variant (icp_point_to_line) for segment maps, which solves for the
+# rigid transform directly, using the wall normals. Segment maps
+# (SegmentMap) are defined in arena_map.
+# IcpSession runs ICP on consecutive scans, keeping the last correction.
+#
+# All transforms are similarity transforms, in the form of
+# (scale, cos(angle), sin(angle), x_translation, y_translation)
+# as returned by estimate_transform.
+from math import sqrt, sin, cos, atan2
+import numpy as np
+from scipy.spatial import cKDTree
+from slam_b_library import SimilarityTransform, estimate_transform_array
+from arena_map import SegmentMap
+
+
+# Applies a similarity transform, given as a tuple, to all points of an
+# (n, 2) array.
+def apply_transform_array(trafo, points):
+    return SimilarityTransform.from_tuple(trafo).apply(points)
+
+
+class PointMap(object):
+    """A reference point cloud. Closest points are found using a kd-tree."""
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.tree = cKDTree(self.points)
+
+    def closest_points(self, points, max_distance):
+        """For an (n, 2) array of points, returns the (n, 2) array of the
+           closest reference points and the (n,) array of distances. If
+           there is no reference point within max_distance, the distance
+           is inf (and the closest point is undefined)."""
+        distances, indices = self.tree.query(
+            points, distance_upper_bound=max_distance)
+        found = np.isfinite(distances)
+        closest = np.zeros((len(distances), 2))
+        closest[found] = self.points[indices[found]]
+        return closest, distances
+
+
+# ICP: Iterates the steps of transforming the points, finding the closest
+# reference point of each (within max_distance) and estimating the
+# transform from the point pairs.
+# The iteration stops after max_iterations, or if the rotation angle of the
+# transform increment is below min_rotation and its translation is below
+# min_translation, or if the RMS residual changes less than
+# min_residual_change, or if no transform can be estimated (in which case
+# the last transform is kept).
+# Returns (trafo, iterations, residuals), where residuals is the list of
+# RMS distances between the point pairs, one for each iteration.
+def icp(points, reference, max_distance,
+        max_iterations = 40, initial_trafo = (1.0, 1.0, 0.0, 0.0, 0.0),
+        min_translation = 0.1, min_rotation = 1e-4,
+        min_residual_change = 0.0, fix_scale = True):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    overall = SimilarityTransform.from_tuple(initial_trafo)
+    residuals = []
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        transformed = overall.apply(points)
+        closest, distances = reference.closest_points(transformed,
+                                                      max_distance)
+        valid = np.isfinite(distances)
+        trafo = estimate_transform_array(transformed[valid], closest[valid],
+                                         fix_scale)
+        if not trafo:
+            break
+        residuals.append(sqrt(np.mean(distances[valid] ** 2)))
+        overall = SimilarityTransform.from_tuple(trafo).compose(overall)
+
+        la, c, s, tx, ty = trafo
+        if abs(atan2(s, c)) < min_rotation and \
+           sqrt(tx * tx + ty * ty) < min_translation:
+            break
+        if len(residuals) > 1 and \
+           abs(residuals[-2] - residuals[-1]) < min_residual_change:
+            break
+
+    return overall.to_tuple(), iterations, residuals
+
+
+# ICP over a sequence of scans. If warm_start is True, each scan starts from
+# the correction of the previous scan (or, if extrapolate is True, from the
+# linear extrapolation of the last two corrections) instead of the identity.
+# This pays off if the corrections are applied to a pose which does not
+# include the previous corrections. If they are (as in slam_05_c), the
+# corrections of consecutive scans are not correlated, and a cold start
+# needs about the same number of iterations.
+# A correction is kept as (dx, dy, dheading) of the robot position, which
+# does not depend on where the robot is, and converted to a transform (which
+# rotates around the origin) for the current pose.
+# If ICP cannot estimate any transform for a scan (e.g. too few matches),
+# the last accepted correction is returned (also without warm_start), or
+# the identity if there is none yet, and the state is left unchanged.
+class IcpSession(object):
+    def __init__(self, reference = None, max_distance = 150.0,
+                 max_iterations = 40, warm_start = True, extrapolate = False,
+                 min_translation = 0.1, min_rotation = 1e-4):
+        if reference is None:
+            reference = SegmentMap.arena()
+        self.reference = reference
+        self.max_distance = max_distance
+        self.max_iterations = max_iterations
+        self.warm_start = warm_start
+        self.extrapolate = extrapolate
+        self.min_translation = min_translation
+        self.min_rotation = min_rotation
+        # The last corrections, most recent first.
+        self.corrections = []
+        # Number of iterations used for the last scan.
+        self.iterations = 0
+
+    @staticmethod
+    def correction_to_transform(pose, correction):
+        dx, dy, dheading = correction
+        c, s = cos(dheading), sin(dheading)
+        tx = pose[0] + dx - (c * pose[0] - s * pose[1])
+        ty = pose[1] + dy - (s * pose[0] + c * pose[1])
+        return (1.0, c, s, tx, ty)
+
+    @staticmethod
+    def transform_to_correction(pose, trafo):
+        x, y = apply_transform_array(trafo, [pose[0:2]])[0]
+        la, c, s, tx, ty = trafo
+        return (x - pose[0], y - pose[1], atan2(s, c))
+
+    def last_correction(self):
+        if not self.corrections:
+            return (0.0, 0.0, 0.0)
+        return self.corrections[0]
+
+    def predicted_correction(self):
+        if not self.warm_start or not self.corrections:
+            return (0.0, 0.0, 0.0)
+        if not self.extrapolate or len(self.corrections) < 2:
+            return self.corrections[0]
+        last, previous = self.corrections[0], self.corrections[1]
+        return tuple(2 * a - b for a, b in zip(last, previous))
+
+    def get_transform(self, pose, world_points):
+        """Returns the transform which corrects pose, given the scan points
+           in world coordinates (computed using pose)."""
+        seed = self.correction_to_transform(pose, self.predicted_correction())
+        trafo, self.iterations, residuals = icp(
+            world_points, self.reference, self.max_distance,
+            self.max_iterations, seed,
+            self.min_translation, self.min_rotation)
+        if not residuals:
+            return self.correction_to_transform(pose, self.last_correction())
+        self.corrections = [self.transform_to_correction(pose, trafo)] + \
+                           self.corrections[:1]
+        return trafo
+
+
+# Estimates the rigid transform (rotation and translation) which minimizes
+# the sum of squared distances of the points to the lines through their
+# closest points, with the given normals. The rotation is linearized
+# (sin(angle) = angle, cos(angle) = 1), around the center of the points,
+# which leads to a 3x3 system of normal equations for (tx, ty, angle).
+# If the points do not constrain all 3 parameters (e.g. all are on the
+# same wall), the minimum norm solution is used, i.e. the points are not
+# moved in the unconstrained direction.
+# Returns the transform as (1.0, cos(angle), sin(angle), tx, ty).
+def estimate_point_to_line_transform(points, closest, normals):
+    center = np.mean(points, axis=0)
+    p = points - center
+    A = np.column_stack((normals[:, 0], normals[:, 1],
+                         normals[:, 1] * p[:, 0] - normals[:, 0] * p[:, 1]))
+    b = np.sum(normals * (closest - points), axis=1)
+    x = np.linalg.lstsq(np.dot(A.T, A), np.dot(A.T, b), rcond=1e-10)[0]
+    c, s = np.cos(x[2]), np.sin(x[2])
+    # Rotation around the center, followed by the translation.
+    tx = center[0] + x[0] - (c * center[0] - s * center[1])
+    ty = center[1] + x[1] - (s * center[0] + c * center[1])
+    return (1.0, c, s, tx, ty)
+
+# Point-to-line ICP against a SegmentMap. Same parameters and return value
+# as icp, except that the transform is always rigid (scale 1). Since points
+# may slide along the walls, this usually converges in a few iterations.
+def icp_point_to_line(points, segment_map, max_distance,
+                      max_iterations = 10,
+                      initial_trafo = (1.0, 1.0, 0.0, 0.0, 0.0),
+                      min_translation = 0.1, min_rotation = 1e-4,
+                      min_residual_change = 0.0):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    overall = SimilarityTransform.from_tuple(initial_trafo)
+    residuals = []
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        transformed = overall.apply(points)
+        closest, normals, distances = \
+            segment_map.closest_points_and_normals(transformed, max_distance)
+        valid = np.isfinite(distances)
+        if np.count_nonzero(valid) < 2:
+            break
+        trafo = estimate_point_to_line_transform(
+            transformed[valid], closest[valid], normals[valid])
+        residuals.append(sqrt(np.mean(distances[valid] ** 2)))
+        overall = SimilarityTransform.from_tuple(trafo).compose(overall)
+
+        la, c, s, tx, ty = trafo
+        if abs(atan2(s, c)) < min_rotation and \
+           sqrt(tx * tx + ty * ty) < min_translation:
+            break
+        if len(residuals) > 1 and \
+           abs(residuals[-2] - residuals[-1]) < min_residual_change:
+            break
+
+    return overall.to_tuple(), iterations, residuals
+
+# Drop-in replacement for get_icp_transform in slam_05_c, using
+# point-to-line ICP. By default, the reference is the arena and points are
+# used if they are closer than eps to a wall, as in
+# get_corresponding_points_on_wall. iterations is the maximum number of
+# iterations.
+def get_icp_transform_point_to_line(world_points, iterations = 10,
+                                    segment_map = None, eps = 150.0):
+    if segment_map is None:
+        segment_map = SegmentMap.arena()
+    trafo, used_iterations, residuals = icp_point_to_line(
+        world_points, segment_map, eps, max_iterations = iterations)
+    return trafo
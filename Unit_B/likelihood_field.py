@@ -0,0 +1,141 @@
+# Likelihood field of the arena: the distance from every node of a regular
+# grid to the nearest obstacle (wall or landmark cylinder), computed once,
+# using a distance transform. Afterwards, the distance of any point to the
+# nearest obstacle is found by a bilinear lookup, instead of a search, and
+# scoring a pose (or many poses) with a scan becomes an array gather.
+from math import ceil
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+from lego_robot import LegoLogfile
+from arena_map import SegmentMap
+
+
+class LikelihoodField(object):
+    """Distance field of a raster of occupied nodes, given as a 2D boolean
+       array, where node [i, j] is at origin + (i, j) * resolution.
+       Distances are clipped to max_distance and stored as float32.
+       Use from_map to build the field of walls and landmarks."""
+    def __init__(self, occupied, origin, resolution, max_distance = 500.0):
+        self.resolution = float(resolution)
+        self.max_distance = float(max_distance)
+        self.origin = np.array(origin, dtype=float)
+        self.shape = occupied.shape
+        distances = distance_transform_edt(~occupied) * self.resolution
+        self.distances = np.minimum(distances, self.max_distance).astype(
+            np.float32)
+
+    @staticmethod
+    def from_map(segment_map, landmarks = (), resolution = 10.0,
+                 max_distance = 500.0):
+        """Returns the field of a SegmentMap and a list of cylinder
+           landmarks, given as (x, y, radius) tuples. The field has a node
+           every resolution mm and covers the obstacles with a margin of
+           max_distance."""
+        landmarks = np.asarray(landmarks, dtype=float).reshape(-1, 3)
+
+        # Bounding box of all obstacles.
+        corners = [segment_map.segments.reshape(-1, 2)]
+        if len(landmarks):
+            corners.append(landmarks[:, 0:2] - landmarks[:, 2:3])
+            corners.append(landmarks[:, 0:2] + landmarks[:, 2:3])
+        corners = np.concatenate(corners)
+        origin = np.min(corners, axis=0) - max_distance
+        extent = np.max(corners, axis=0) + max_distance - origin
+        shape = tuple(int(ceil(e / resolution)) + 1 for e in extent)
+
+        # Rasterize the obstacles.
+        occupied = np.zeros(shape, dtype=bool)
+        rasterize_segments(occupied, origin, resolution, segment_map)
+        for x, y, r in landmarks:
+            rasterize_disk(occupied, origin, resolution, x, y, r)
+        return LikelihoodField(occupied, origin, resolution, max_distance)
+
+    @staticmethod
+    def from_landmark_file(filename = "robot_arena_landmarks.txt",
+                           segment_map = None, resolution = 10.0,
+                           max_distance = 500.0):
+        """Returns the field of the arena walls (or the given segment_map)
+           and the landmarks ('L C x y radius' lines) in filename."""
+        if segment_map is None:
+            segment_map = SegmentMap.arena()
+        logfile = LegoLogfile()
+        logfile.read(filename)
+        landmarks = [l[1:4] for l in logfile.landmarks if l[0] == 'C']
+        return LikelihoodField.from_map(segment_map, landmarks, resolution,
+                                        max_distance)
+
+    def distance(self, points):
+        """For an (n, 2) array of world points, returns the (n,) array of the
+           (bilinearly interpolated) distances to the nearest obstacle.
+           Points outside the field get max_distance."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        g = (points - self.origin) / self.resolution
+        i = np.floor(g).astype(int)
+        f = g - i
+        nx, ny = self.shape
+        inside = (i[:, 0] >= 0) & (i[:, 0] < nx - 1) & \
+                 (i[:, 1] >= 0) & (i[:, 1] < ny - 1)
+        result = np.empty(len(points))
+        result[~inside] = self.max_distance
+
+        # Gather the four surrounding nodes from the flat array.
+        flat = self.distances.ravel()
+        k = i[inside, 0] * ny + i[inside, 1]
+        fx, fy = f[inside, 0], f[inside, 1]
+        d00, d01 = flat[k], flat[k + 1]
+        d10, d11 = flat[k + ny], flat[k + ny + 1]
+        result[inside] = (d00 * (1.0 - fx) + d10 * fx) * (1.0 - fy) + \
+                         (d01 * (1.0 - fx) + d11 * fx) * fy
+        return result
+
+    def score_poses(self, poses, scanner_points, sigma = 50.0):
+        """Scores each of the (k, 3) poses (x, y, heading) by the scan,
+           given as an (n, 2) array of points in the scanner's coordinate
+           system. The score is the sum of exp(-d^2 / (2 sigma^2)) over all
+           points, where d is the distance of the point (transformed to the
+           world using the pose) to the nearest obstacle.
+           Returns the (k,) array of scores."""
+        poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+        points = np.asarray(scanner_points, dtype=float).reshape(-1, 2)
+        c = np.cos(poses[:, 2])[:, np.newaxis]
+        s = np.sin(poses[:, 2])[:, np.newaxis]
+        world = np.empty((len(poses), len(points), 2))
+        world[:, :, 0] = c * points[:, 0] - s * points[:, 1] + \
+            poses[:, 0:1]
+        world[:, :, 1] = s * points[:, 0] + c * points[:, 1] + \
+            poses[:, 1:2]
+        d = self.distance(world.reshape(-1, 2)).reshape(len(poses), -1)
+        return np.sum(np.exp(-0.5 * (d / sigma) ** 2), axis=1)
+
+    def score_pose(self, pose, scanner_points, sigma = 50.0):
+        """Same as score_poses, for a single pose."""
+        return self.score_poses([pose], scanner_points, sigma)[0]
+
+
+# Sample all segments of segment_map at half the resolution and mark the
+# nodes closest to the samples in occupied.
+def rasterize_segments(occupied, origin, resolution, segment_map):
+    lengths = np.sqrt(segment_map.length2)
+    counts = np.ceil(2.0 * lengths / resolution).astype(int) + 1
+    segment_of_sample = np.repeat(np.arange(len(lengths)), counts)
+    first = np.cumsum(counts) - counts
+    k = np.arange(counts.sum()) - np.repeat(first, counts)
+    t = k / np.maximum(counts - 1, 1).astype(float)[segment_of_sample]
+    samples = segment_map.start[segment_of_sample] + \
+        t[:, np.newaxis] * segment_map.direction[segment_of_sample]
+    nodes = np.rint((samples - origin) / resolution).astype(int)
+    occupied[nodes[:, 0], nodes[:, 1]] = True
+
+# Mark all nodes inside the cylinder (at least the closest node).
+def rasterize_disk(occupied, origin, resolution, x, y, radius):
+    center = (np.array([x, y]) - origin) / resolution
+    r = radius / resolution
+    ix = np.arange(int(np.floor(center[0] - r)),
+                   int(np.ceil(center[0] + r)) + 1)
+    iy = np.arange(int(np.floor(center[1] - r)),
+                   int(np.ceil(center[1] + r)) + 1)
+    inside = (ix[:, np.newaxis] - center[0]) ** 2 + \
+             (iy[np.newaxis, :] - center[1]) ** 2 <= r * r
+    occupied[ix[0]:ix[-1] + 1, iy[0]:iy[-1] + 1] |= inside
+    nearest = np.rint(center).astype(int)
+    occupied[nearest[0], nearest[1]] = True
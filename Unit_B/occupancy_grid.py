@@ -0,0 +1,129 @@
+# Occupancy grid mapping: builds a dense map of the environment from the
+# scans and the (scanner) poses of a filter. Every cell holds the log odds
+# of being occupied. For each beam, the cells the beam passes through get
+# the (negative) log odds of a free cell, and the cell of the end point
+# gets the log odds of an occupied cell.
+# All beams of a scan are traced at once: each beam is sampled at a spacing
+# of half a cell (a DDA with a fixed step), the samples are converted to
+# cells, and duplicates within a beam are removed, so that every cell is
+# updated at most once per beam. The updates are accumulated (np.bincount,
+# np.add.at), since many beams pass through the same cells.
+from math import ceil
+import numpy as np
+from lego_robot import LegoLogfile
+from likelihood_field import LikelihoodField
+
+
+class OccupancyGrid(object):
+    """Occupancy grid covering lower to upper (both (x, y), in mm), with
+       cells of size resolution. log_odds_occupied and log_odds_free are
+       the updates for a hit and a pass, and the log odds of all cells are
+       clipped to [-log_odds_limit, log_odds_limit]."""
+    def __init__(self, lower = (-500.0, -500.0), upper = (2500.0, 2500.0),
+                 resolution = 20.0, log_odds_occupied = 0.85,
+                 log_odds_free = -0.4, log_odds_limit = 5.0):
+        self.origin = np.array(lower, dtype=float)
+        self.resolution = float(resolution)
+        self.shape = tuple(int(ceil((u - l) / self.resolution))
+                           for l, u in zip(lower, upper))
+        self.log_odds = np.zeros(self.shape, dtype=np.float32)
+        self.log_odds_occupied = log_odds_occupied
+        self.log_odds_free = log_odds_free
+        self.log_odds_limit = log_odds_limit
+
+    def cells(self, points):
+        """Returns the (n, 2) integer cell indices of an (n, 2) array of
+           points, and a boolean array telling which are inside the grid."""
+        c = np.floor((points - self.origin) / self.resolution).astype(int)
+        inside = (c[:, 0] >= 0) & (c[:, 0] < self.shape[0]) & \
+                 (c[:, 1] >= 0) & (c[:, 1] < self.shape[1])
+        return c, inside
+
+    def add_scan(self, pose, scan, min_valid_distance = 20.0,
+                 max_range = None):
+        """Updates the grid with one scan, taken at the scanner pose
+           (x, y, heading). Beams shorter than min_valid_distance are
+           ignored. Beams longer than max_range only clear the cells up to
+           max_range, and do not mark their end point as occupied."""
+        scan = np.asarray(scan, dtype=float)
+        beams = np.flatnonzero(scan > min_valid_distance)
+        ranges = scan[beams]
+        hit = np.ones(len(beams), dtype=bool)
+        if max_range is not None:
+            hit = ranges <= max_range
+            ranges = np.minimum(ranges, max_range)
+        angles = pose[2] + LegoLogfile.beam_index_to_angle(beams)
+        directions = np.column_stack((np.cos(angles), np.sin(angles)))
+
+        # Sample all beams, from the scanner to just before the end point.
+        step = 0.5 * self.resolution
+        counts = np.ceil(ranges / step).astype(int)
+        beam_of_sample = np.repeat(np.arange(len(beams)), counts)
+        first = np.cumsum(counts) - counts
+        k = np.arange(counts.sum()) - np.repeat(first, counts)
+        samples = np.asarray(pose[0:2]) + \
+            (k * step)[:, np.newaxis] * directions[beam_of_sample]
+        cells, inside = self.cells(samples)
+        ends, end_inside = self.cells(
+            np.asarray(pose[0:2]) + ranges[:, np.newaxis] * directions)
+
+        # Free cells: each cell once per beam, but not the end cell. Since
+        # the samples of a beam are ordered along a line, duplicates are
+        # consecutive.
+        flat = cells[:, 0] * self.shape[1] + cells[:, 1]
+        end_flat = ends[:, 0] * self.shape[1] + ends[:, 1]
+        keep = inside & (flat != end_flat[beam_of_sample])
+        keep[1:] &= (flat[1:] != flat[:-1]) | \
+                    (beam_of_sample[1:] != beam_of_sample[:-1])
+        # There are many free cells, so they are counted with bincount,
+        # which is much faster than np.add.at.
+        log_odds = self.log_odds.ravel()
+        log_odds += self.log_odds_free * np.bincount(
+            flat[keep], minlength=len(log_odds)).astype(np.float32)
+
+        # Occupied cells.
+        occupied = hit & end_inside
+        np.add.at(log_odds, end_flat[occupied], self.log_odds_occupied)
+        np.clip(self.log_odds, -self.log_odds_limit, self.log_odds_limit,
+                out=self.log_odds)
+
+    def add_scans(self, poses, scans, min_valid_distance = 20.0,
+                  max_range = None):
+        """Updates the grid with all scans, scans[i] taken at poses[i]."""
+        for pose, scan in zip(poses, scans):
+            self.add_scan(pose, scan, min_valid_distance, max_range)
+
+    def probabilities(self):
+        """Returns the array of occupancy probabilities."""
+        return 1.0 - 1.0 / (1.0 + np.exp(self.log_odds))
+
+    def occupied_cells(self, threshold = 0.5):
+        """Returns the (n, 2) array of the centers of all cells with an
+           occupancy probability above threshold."""
+        i, j = np.nonzero(self.probabilities() > threshold)
+        return self.origin + (np.column_stack((i, j)) + 0.5) * \
+            self.resolution
+
+    def to_likelihood_field(self, threshold = 0.5, max_distance = 500.0):
+        """Returns the LikelihoodField of the occupied cells, e.g. for
+           scoring poses or correlative scan matching. Its nodes are the
+           cell centers."""
+        return LikelihoodField(self.probabilities() > threshold,
+                               self.origin + 0.5 * self.resolution,
+                               self.resolution, max_distance)
+
+    def write_pgm(self, filename):
+        """Writes the grid as a binary PGM image, white for free and black
+           for occupied cells, with x to the right and y up."""
+        image = np.rint(255.0 * (1.0 - self.probabilities())).astype(np.uint8)
+        f = open(filename, "wb")
+        f.write("P5\n%d %d\n255\n" % (self.shape[0], self.shape[1]))
+        f.write(image.T[::-1].tobytes())
+        f.close()
+
+    def write_landmarks(self, file_desc, threshold = 0.5):
+        """Writes all occupied cells as landmarks ('L C x y radius'), which
+           are drawn by the logfile viewer as a background."""
+        for x, y in self.occupied_cells(threshold):
+            print >> file_desc, "L C %.1f %.1f %.1f" % \
+                (x, y, 0.5 * self.resolution)
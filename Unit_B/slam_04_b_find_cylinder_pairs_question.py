@@ -6,13 +6,19 @@
 # Pls don't forget to import math, otherwise sqrt and ** can not be used
 from lego_robot import *
 from slam_b_library import filter_step, compute_scanner_cylinders,\
-    write_cylinders
+    write_cylinders, find_cylinder_pairs_one_to_one
 import math
 # Given a list of cylinders (points) and reference_cylinders:
 # For every cylinder, find the closest reference_cylinder and add
 # the index pair (i, j), where i is the index of the cylinder, and
 # j is the index of the reference_cylinder, to the result list.
-def find_cylinder_pairs(cylinders, reference_cylinders, max_radius):
+# If one_to_one is True, every cylinder and reference cylinder is used at
+# most once, see find_cylinder_pairs_one_to_one in slam_b_library.
+def find_cylinder_pairs(cylinders, reference_cylinders, max_radius,
+                        one_to_one = False):
+    if one_to_one:
+        return find_cylinder_pairs_one_to_one(
+            cylinders, reference_cylinders, max_radius)
     cylinder_pairs = []
 
     # --->>> Enter your code here.
@@ -48,6 +54,8 @@ if __name__ == '__main__':
 
     # The maximum distance allowed for cylinder assignment.
     max_cylinder_distance = 300.0
+    # If True, every cylinder and reference cylinder is used at most once.
+    one_to_one = False
 
     # The start pose we obtained miraculously.
     pose = (1850.0, 1897.0, 3.717551306747922)
@@ -78,7 +86,8 @@ if __name__ == '__main__':
 
         # For every cylinder, find the closest reference cylinder.
         cylinder_pairs = find_cylinder_pairs(
-            world_cylinders, reference_cylinders, max_cylinder_distance)
+            world_cylinders, reference_cylinders, max_cylinder_distance,
+            one_to_one)
 
         # Write to file.
         # The pose.
@@ -7,7 +7,7 @@
 # Claus Brenner, 14 NOV 2012
 from lego_robot import *
 from slam_b_library import filter_step, compute_scanner_cylinders,\
-    write_cylinders
+    write_cylinders, find_cylinder_pairs_one_to_one
 from math import sqrt, atan2
 import numpy as np
 
@@ -15,13 +15,19 @@ import numpy as np
 # For every cylinder, find the closest reference_cylinder and add
 # the index pair (i, j), where i is the index of the cylinder, and
 # j is the index of the reference_cylinder, to the result list.
+# If one_to_one is True, every cylinder and reference cylinder is used at
+# most once, see find_cylinder_pairs_one_to_one in slam_b_library.
 # This is the function developed in slam_04_b_find_cylinder_pairs.
 def compute_dist(a, b):
     x = a[0] - b[0]
     y = a[1] - b[1]
     return np.sqrt(x*x + y*y)
 
-def find_cylinder_pairs(cylinders, reference_cylinders, max_radius):
+def find_cylinder_pairs(cylinders, reference_cylinders, max_radius,
+                        one_to_one = False):
+    if one_to_one:
+        return find_cylinder_pairs_one_to_one(
+            cylinders, reference_cylinders, max_radius)
     cylinder_pairs = []
 
     # --->>> Insert here your code from the last question,
@@ -142,6 +148,8 @@ if __name__ == '__main__':
 
     # The maximum distance allowed for cylinder assignment.
     max_cylinder_distance = 400.0
+    # If True, every cylinder and reference cylinder is used at most once.
+    one_to_one = False
 
     # The start pose we obtained miraculously.
     pose = (1850.0, 1897.0, 3.717551306747922)
@@ -171,7 +179,8 @@ if __name__ == '__main__':
 
         # For every cylinder, find the closest reference cylinder.
         cylinder_pairs = find_cylinder_pairs(
-            world_cylinders, reference_cylinders, max_cylinder_distance)
+            world_cylinders, reference_cylinders, max_cylinder_distance,
+            one_to_one)
 
         # Estimate a transformation using the cylinder pairs.
         trafo = estimate_transform(
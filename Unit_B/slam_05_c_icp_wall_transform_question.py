@@ -6,7 +6,8 @@
 # 05_c_icp_wall_transform
 # Claus Brenner, 17 NOV 2012
 from lego_robot import *
-from slam_b_library import filter_step, concatenate_transform, compute_cartesian_coordinates, write_cylinders
+from slam_b_library import filter_step, concatenate_transform, compute_cartesian_coordinates, write_cylinders,\
+    estimate_transform_array, SimilarityTransform
 from math import sqrt, atan2
 from slam_04_d_apply_transform_question import estimate_transform, apply_transform, correct_pose
 from slam_05_a_find_wall_pairs_question import get_subsampled_points, get_corresponding_points_on_wall
@@ -181,9 +182,9 @@ def get_icp_transform(world_points, iterations):
 
 
     for j in range(iterations):
-        world_points_1 = [apply_transform(overall_trafo, p) for p in world_points]  # new usage
+        world_points_1 = SimilarityTransform.from_tuple(overall_trafo).apply(world_points)
         left, right = get_corresponding_points_on_wall(world_points_1)
-        trafo = estimate_transform(left, right, fix_scale=True)
+        trafo = estimate_transform_array(left, right, fix_scale=True)
         if trafo:
             overall_trafo = concatenate_transform(trafo, overall_trafo)
         else:
@@ -198,6 +199,23 @@ if __name__ == '__main__':
     ticks_to_mm = 0.349
     robot_width = 150.0
 
+    # If use_icp_session is True, ICP stops as soon as it has converged
+    # (about 20 instead of 40 iterations on this log), and keeps the last
+    # good transform if no transform can be estimated. warm_start seeds
+    # each scan with the correction of the previous scan. This does not
+    # help here, since the pose already includes the previous corrections
+    # (21.9 instead of 19.9 iterations on average), so it is off. The
+    # default is the original get_icp_transform with 40 iterations.
+    use_icp_session = False
+    warm_start = False
+    extrapolate = False
+    if use_icp_session:
+        # The session (and scipy, which it needs) is only imported if used.
+        from icp import IcpSession
+        icp_session = IcpSession(max_distance = 150.0, max_iterations = 40,
+                                 warm_start = warm_start,
+                                 extrapolate = extrapolate)
+
     # The start pose we obtained miraculously.
     pose = (1850.0, 1897.0, 3.717551306747922)
 
@@ -222,7 +240,10 @@ if __name__ == '__main__':
         # Get the transformation.
         # You may play withe the number of iterations here to see
         # the effect on the trajectory!
-        trafo = get_icp_transform(world_points, iterations = 40)
+        if use_icp_session:
+            trafo = icp_session.get_transform(pose, world_points)
+        else:
+            trafo = get_icp_transform(world_points, iterations = 40)
 
         # Correct the initial position using trafo.
         pose = correct_pose(pose, trafo)
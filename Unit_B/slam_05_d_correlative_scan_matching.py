@@ -0,0 +1,66 @@
+# Same as slam_05_c, but corrects the pose using correlative scan matching
+# instead of ICP: all poses in a window around the predicted pose are
+# scored against the likelihood field of the arena walls and landmarks,
+# and the best one is taken.
+# 05_d_correlative_scan_matching
+from lego_robot import *
+from slam_b_library import filter_step, write_cylinders
+from slam_04_d_apply_transform_question import apply_transform, correct_pose
+from slam_05_a_find_wall_pairs_question import get_subsampled_points
+from likelihood_field import LikelihoodField
+from correlative_scan_matcher import CorrelativeScanMatcher,\
+    get_correlative_transform
+
+
+if __name__ == '__main__':
+    # The constants we used for the filter_step.
+    scanner_displacement = 30.0
+    ticks_to_mm = 0.349
+    robot_width = 150.0
+
+    # The search window, around the predicted pose.
+    search_distance = 200.0
+    search_angle = 10.0 / 180.0 * pi
+
+    # The start pose we obtained miraculously.
+    pose = (1850.0, 1897.0, 3.717551306747922)
+
+    # Read the logfile which contains all scans.
+    logfile = LegoLogfile()
+    logfile.read("robot4_motors.txt")
+    logfile.read("robot4_scan.txt")
+
+    # Precompute the lookup tables, once.
+    matcher = CorrelativeScanMatcher(
+        LikelihoodField.from_landmark_file("robot_arena_landmarks.txt",
+                                           resolution = 10.0),
+        sigma = 50.0, block_size = 8)
+
+    # Iterate over all positions.
+    out_file = file("correlative_scan_matching.txt", "w")
+    for i in xrange(len(logfile.scan_data)):
+        # Compute the new pose.
+        pose = filter_step(pose, logfile.motor_ticks[i],
+                           ticks_to_mm, robot_width,
+                           scanner_displacement)
+
+        # Subsample points.
+        subsampled_points = get_subsampled_points(logfile.scan_data[i])
+        world_points = [LegoLogfile.scanner_to_world(pose, c)
+                        for c in subsampled_points]
+
+        # Get the transformation.
+        trafo = get_correlative_transform(pose, subsampled_points, matcher,
+                                          search_distance, search_angle)
+
+        # Correct the initial position using trafo.
+        pose = correct_pose(pose, trafo)
+
+        # Write to file.
+        # The pose.
+        print >> out_file, "F %f %f %f" % pose
+        # Write the scanner points and corresponding points.
+        write_cylinders(out_file, "W C",
+            [apply_transform(trafo, p) for p in world_points])
+
+    out_file.close()
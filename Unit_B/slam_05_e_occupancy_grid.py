@@ -0,0 +1,31 @@
+# Builds an occupancy grid map from all scans of the log, using the poses
+# computed by the ICP in slam_05_c (run it first). The map is written as an
+# image (occupancy_grid.pgm) and as landmarks for the logfile viewer
+# (occupancy_grid.txt).
+# 05_e_occupancy_grid
+from lego_robot import *
+import timeit
+from occupancy_grid import OccupancyGrid
+
+
+if __name__ == '__main__':
+    # Cells of 20 mm, covering the arena with a margin.
+    resolution = 20.0
+    minimum_valid_distance = 20.0
+
+    # Read the scans and the (scanner) poses.
+    logfile = LegoLogfile()
+    logfile.read("robot4_scan.txt")
+    logfile.read("icp_wall_transform.txt")
+
+    start = timeit.default_timer()
+    grid = OccupancyGrid((-500.0, -500.0), (2500.0, 2500.0), resolution)
+    grid.add_scans(logfile.filtered_positions, logfile.scan_data,
+                   minimum_valid_distance)
+    print "Mapped %d scans in %.2f s." % \
+        (len(logfile.scan_data), timeit.default_timer() - start)
+
+    grid.write_pgm("occupancy_grid.pgm")
+    out_file = file("occupancy_grid.txt", "w")
+    grid.write_landmarks(out_file)
+    out_file.close()
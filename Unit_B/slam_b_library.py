@@ -4,6 +4,7 @@
 # Claus Brenner, 17.11.2012
 from math import sin, cos, pi
 from lego_robot import *
+import numpy as np
 
 # This function takes the old (x, y, heading) pose and the motor ticks
 # (ticks_left, ticks_right) and returns the new (x, y, heading).
@@ -100,6 +101,71 @@ def compute_scanner_cylinders(scan, jump, min_dist, cylinder_offset):
     scanner_cylinders = compute_cartesian_coordinates(cylinders, cylinder_offset)
     return scanner_cylinders
 
+# Given a list of cylinders (points) and reference_cylinders, find a one to
+# one assignment, i.e. every cylinder and every reference cylinder is used
+# at most once. Among all such assignments using only pairs closer than
+# max_radius, the one with the largest number of pairs and, for this
+# number, the smallest sum of squared distances is returned.
+# - Candidate pairs are found using a kd-tree over the reference cylinders,
+#   so there is no loop over all (cylinder, reference) combinations.
+# - The candidate pairs form a sparse bipartite graph. Each of its connected
+#   components (usually a single pair) is solved as a linear assignment
+#   problem, where non-candidate pairs get a prohibitive cost.
+# Returns a list of index pairs (i, j), sorted by i, as find_cylinder_pairs.
+def find_cylinder_pairs_one_to_one(cylinders, reference_cylinders,
+                                   max_radius):
+    # Only this function needs scipy, so it is imported here.
+    from scipy.spatial import cKDTree
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    from scipy.optimize import linear_sum_assignment
+    if not len(cylinders) or not len(reference_cylinders):
+        return []
+    cylinders = np.asarray(cylinders, dtype=float).reshape(-1, 2)
+    reference_cylinders = np.asarray(reference_cylinders, dtype=float)
+    tree = cKDTree(reference_cylinders)
+    neighbours = tree.query_ball_point(cylinders, max_radius)
+    rows = np.repeat(np.arange(len(cylinders)), [len(n) for n in neighbours])
+    if not len(rows):
+        return []
+    cols = np.concatenate([np.asarray(n, dtype=int) for n in neighbours])
+    d = cylinders[rows] - reference_cylinders[cols]
+    cost = np.sum(d * d, axis=1)
+    keep = cost < max_radius * max_radius
+    rows, cols, cost = rows[keep], cols[keep], cost[keep]
+    if not len(rows):
+        return []
+
+    # Connected components of the bipartite graph, where cylinders are the
+    # nodes 0..n-1 and reference cylinders the nodes n..n+m-1.
+    n, m = len(cylinders), len(reference_cylinders)
+    graph = coo_matrix((np.ones(len(rows)), (rows, n + cols)),
+                       shape=(n + m, n + m))
+    _, labels = connected_components(graph, directed=False)
+
+    cylinder_pairs = []
+    # Larger than the cost of any assignment which consists of candidates.
+    prohibitive = max_radius * max_radius * (len(rows) + 1)
+    component_of_pair = labels[rows]
+    order = np.argsort(component_of_pair, kind='mergesort')
+    splits = np.nonzero(np.diff(component_of_pair[order]))[0] + 1
+    for pair_indices in np.split(order, splits):
+        if len(pair_indices) == 1:
+            k = pair_indices[0]
+            cylinder_pairs.append((int(rows[k]), int(cols[k])))
+            continue
+        r, row_of = np.unique(rows[pair_indices], return_inverse=True)
+        c, col_of = np.unique(cols[pair_indices], return_inverse=True)
+        matrix = np.full((len(r), len(c)), prohibitive)
+        matrix[row_of, col_of] = cost[pair_indices]
+        assigned_rows, assigned_cols = linear_sum_assignment(matrix)
+        for a, b in zip(assigned_rows, assigned_cols):
+            if matrix[a, b] < prohibitive:
+                cylinder_pairs.append((int(r[a]), int(c[b])))
+
+    cylinder_pairs.sort()
+    return cylinder_pairs
+
 # Utility to write a list of cylinders to (one line of) a given file.
 # Line header defines the start of each line, e.g. "D C" for a detected
 # cylinder or "W C" for a world cylinder.
@@ -130,3 +196,122 @@ def concatenate_transform(a, b):
     ty = tya + laa * sa * txb + laa * ca * tyb
 
     return (la, c, s, tx, ty)
+
+# A similarity transform, stored as a 3x3 homogeneous matrix
+#   [[la*c, -la*s, tx],
+#    [la*s,  la*c, ty],
+#    [   0,     0,  1]].
+# Unlike the tuple form (scale, cos(angle), sin(angle), tx, ty), it can be
+# applied to all points of an (n, 2) array at once, and composed and
+# inverted by matrix operations.
+class SimilarityTransform(object):
+    def __init__(self, matrix = None):
+        if matrix is None:
+            matrix = np.eye(3)
+        self.matrix = np.asarray(matrix, dtype=float)
+
+    @staticmethod
+    def from_tuple(trafo):
+        """Converts (scale, cos(angle), sin(angle), tx, ty)."""
+        la, c, s, tx, ty = trafo
+        return SimilarityTransform([[la * c, -la * s, tx],
+                                    [la * s,  la * c, ty],
+                                    [0.0, 0.0, 1.0]])
+
+    def to_tuple(self):
+        """Returns (scale, cos(angle), sin(angle), tx, ty)."""
+        m = self.matrix
+        la = np.hypot(m[0, 0], m[1, 0])
+        return (la, m[0, 0] / la, m[1, 0] / la, m[0, 2], m[1, 2])
+
+    def apply(self, points):
+        """Transforms all points of an (n, 2) array (or list of (x, y)
+           tuples). Returns an (n, 2) array."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return np.dot(points, self.matrix[0:2, 0:2].T) + self.matrix[0:2, 2]
+
+    def compose(self, other):
+        """Returns the transform "self after other", as
+           concatenate_transform(self, other) does."""
+        return SimilarityTransform(np.dot(self.matrix, other.matrix))
+
+    def inverse(self):
+        """Returns the inverse transform."""
+        m = self.matrix[0:2, 0:2]
+        # The inverse of la * R is R^T / la^2.
+        inv = m.T / (m[0, 0] * m[0, 0] + m[1, 0] * m[1, 0])
+        result = np.eye(3)
+        result[0:2, 0:2] = inv
+        result[0:2, 2] = -np.dot(inv, self.matrix[0:2, 2])
+        return SimilarityTransform(result)
+
+# Array version of estimate_transform, for a batch of b pairs of point sets.
+# left and right are (b, n, 2) arrays, where left[k, i] corresponds to
+# right[k, i]. If the point sets of the batch have different sizes, they
+# may be padded, with mask, a (b, n) boolean array, marking valid points.
+# Returns a list of b transforms, each being a tuple
+# (scale, cos(angle), sin(angle), x_translation, y_translation), or None if
+# the transform can not be determined, i.e. if there are less than two
+# points, or all left or all right points are (numerically) identical.
+def estimate_transform_batch(left, right, fix_scale = False, mask = None):
+    left = np.asarray(left, dtype=float)
+    right = np.asarray(right, dtype=float)
+    if mask is None:
+        w = np.ones(left.shape[0:2])
+    else:
+        w = np.asarray(mask, dtype=float)
+    counts = w.sum(axis=1)
+
+    # Compute left and right center, and the reduced coordinates.
+    lc = np.einsum('bn,bnk->bk', w, left) / np.maximum(counts, 1)[:, None]
+    rc = np.einsum('bn,bnk->bk', w, right) / np.maximum(counts, 1)[:, None]
+    lp = (left - lc[:, None, :]) * w[:, :, None]
+    rp = (right - rc[:, None, :]) * w[:, :, None]
+
+    # Sums of the products of reduced coordinates.
+    cs = np.einsum('bnk,bnk->b', rp, lp)
+    ss = np.einsum('bn,bn->b', rp[:, :, 1], lp[:, :, 0]) - \
+         np.einsum('bn,bn->b', rp[:, :, 0], lp[:, :, 1])
+    rr = np.einsum('bnk,bnk->b', rp, rp)
+    ll = np.einsum('bnk,bnk->b', lp, lp)
+
+    # Degenerate if the points do not spread, relative to their magnitude.
+    l_scale = np.einsum('bn,bnk,bnk->b', w, left, left)
+    r_scale = np.einsum('bn,bnk,bnk->b', w, right, right)
+    eps = 1e-12
+    degenerate = (counts < 2) | (ll <= eps * (1.0 + l_scale)) | \
+                 (rr <= eps * (1.0 + r_scale))
+    identical = np.all(np.all(left == right, axis=2) | (w == 0), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if fix_scale:
+            la = np.ones(len(cs))
+        else:
+            la = np.sqrt(rr / ll)
+        norm = np.hypot(cs, ss)
+        c = cs / norm
+        s = ss / norm
+    degenerate |= norm == 0.0
+
+    tx = rc[:, 0] - la * (c * lc[:, 0] - s * lc[:, 1])
+    ty = rc[:, 1] - la * (s * lc[:, 0] + c * lc[:, 1])
+
+    result = []
+    for k in xrange(len(cs)):
+        if counts[k] >= 2 and identical[k]:
+            result.append((1.0, 1.0, 0.0, 0.0, 0.0))
+        elif degenerate[k]:
+            result.append(None)
+        else:
+            result.append((la[k], c[k], s[k], tx[k], ty[k]))
+    return result
+
+# Array version of estimate_transform for a single pair of point sets,
+# given as (n, 2) arrays (or lists of (x, y) tuples).
+def estimate_transform_array(left, right, fix_scale = False):
+    left = np.asarray(left, dtype=float).reshape(-1, 2)
+    right = np.asarray(right, dtype=float).reshape(-1, 2)
+    if len(left) < 2 or len(right) < 2:
+        return None
+    return estimate_transform_batch(left[np.newaxis], right[np.newaxis],
+                                    fix_scale)[0]
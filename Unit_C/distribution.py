@@ -7,14 +7,92 @@
 # ... -2    -1    0    1    2    3    4    5    6    7    8  ...
 # and start = 2, values = [0.0 0.25 0.5 0.25] represents the same
 # distribution.
+# The values are stored in a numpy array, so that all operations work on
+# whole arrays instead of looping over the values.
 # Claus Brenner, 26 OCT 2012
-from math import exp, ceil
+from math import ceil
+from collections import OrderedDict
+import numpy as np
+
+# Convolution uses the FFT if both distributions have at least this many
+# values, and np.convolve otherwise. The cost of np.convolve grows with the
+# product of the lengths, the cost of the FFT with the sum (times log).
+# Measured with numpy 1.16, the FFT wins if the shorter distribution has
+# more than about 400 values, almost independently of the longer one.
+fft_threshold = 400
+
+# Returns the smallest FFT size which is at least n and has no prime
+# factors other than 2, 3 and 5. The FFT of such sizes is fast, and they
+# need much less padding than powers of 2.
+def fft_size(n):
+    best = 1 << (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+# Returns the full linear convolution of the arrays a and b, i.e. an array
+# of len(a) + len(b) - 1 values, using either np.convolve or the FFT.
+def convolve_values(a, b):
+    if min(len(a), len(b)) < fft_threshold:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = fft_size(n)
+    values = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size),
+                          size)[:n]
+    # Remove the (tiny) negative values caused by rounding errors.
+    return np.maximum(values, 0.0)
+
+# Least recently used cache of the normalized values of kernels, i.e. of
+# gaussian and triangle distributions, which only depend on their shape
+# (e.g. ('gaussian', sigma, cut)), not on their position. The cached arrays
+# are read-only, so that they can be shared by all distributions of the
+# same shape.
+class KernelCache:
+    def __init__(self, max_size = 64):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, make_values):
+        """Returns the cached values for key. If there are none, calls
+           make_values() to compute them, and caches the result."""
+        if key in self.entries:
+            self.hits += 1
+            values = self.entries.pop(key)
+        else:
+            self.misses += 1
+            values = np.array(make_values(), dtype=float)
+            values.flags.writeable = False
+        if self.max_size > 0:
+            self.entries[key] = values
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return values
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+kernel_cache = KernelCache()
 
 class Distribution:
     """This class represents a discrete distribution."""
-    def __init__(self, offset = 0, values = [1.0]):
+    def __init__(self, offset = 0, values = [1.0], copy = True):
         self.offset = offset
-        self.values = values[:]
+        # Copy by default, so that the distribution does not share its values
+        # with the caller (slicing an array would not copy).
+        self.values = np.array(values, dtype=float, copy=copy)
+        # The (relative) mass which was removed by pruning this distribution.
+        self.pruned_mass = 0.0
 
     def __repr__(self):
         s = "start = %d, values =" % self.offset
@@ -32,16 +110,60 @@ class Distribution:
 
     def normalize(self):
         """Normalizes a distribution so that the sum of all values is 1.0."""
-        s = float(sum(self.values))
+        s = float(np.sum(self.values))
         if s != 0.0:
-            self.values = [i / s for i in self.values]
+            self.values = self.values / s
 
-    def value(self, index):
-        index -= self.offset
-        if index < 0 or index >= len(self.values):
+    def prune(self, epsilon, cumulative = True):
+        """Removes leading and trailing values and adjusts the offset. If
+           cumulative is True, the removed values at each end sum up to at
+           most epsilon/2 of the total mass. Otherwise, all leading and
+           trailing values smaller than epsilon times the maximum value are
+           removed. The largest value is always kept.
+           Does not normalize. Returns the removed mass, relative to the total
+           mass, which is also added to pruned_mass."""
+        v = self.values
+        total = float(np.sum(v))
+        if len(v) == 0 or total <= 0.0:
             return 0.0
+        peak = int(np.argmax(v))
+        if cumulative:
+            limit = 0.5 * epsilon * total
+            first = np.searchsorted(np.cumsum(v), limit, side='right')
+            last = len(v) - np.searchsorted(np.cumsum(v[::-1]), limit,
+                                            side='right')
         else:
-            return self.values[index]
+            keep = np.flatnonzero(v >= epsilon * v[peak])
+            first, last = keep[0], keep[-1] + 1
+        first, last = min(first, peak), max(last, peak + 1)
+        if first == 0 and last == len(v):
+            return 0.0
+        # Copy, so that the memory of the removed values is released.
+        self.values = v[first:last].copy()
+        self.offset += first
+        removed = max(1.0 - float(np.sum(self.values)) / total, 0.0)
+        self.pruned_mass += removed
+        return removed
+
+    def writable_values(self):
+        """Returns the values, for modifying them in place. All methods
+           replace the values instead of modifying them, so kernels may share
+           (read-only) values. Those are copied here, before the first
+           modification."""
+        if not self.values.flags.writeable:
+            self.values = self.values.copy()
+        return self.values
+
+    def value(self, index):
+        """Returns the value at index. index may also be an array of indices,
+           in which case an array of values is returned."""
+        index = np.asarray(index) - self.offset
+        inside = (index >= 0) & (index < len(self.values))
+        if index.ndim == 0:
+            return float(self.values[index]) if inside else 0.0
+        result = np.zeros(index.shape)
+        result[inside] = self.values[index[inside]]
+        return result
 
     def plotlists(self, start = None, stop = None):
         if start == None:
@@ -49,9 +171,8 @@ class Distribution:
         if stop == None:
             stop = self.stop()
         if start <= stop:
-            indices = [i + 0.5 for i in xrange(start, stop)]
-            vals = [self.value(i) for i in xrange(start, stop)]
-            return (indices, vals)
+            indices = np.arange(start, stop)
+            return ((indices + 0.5).tolist(), self.value(indices).tolist())
         else:
             return ([], [])
 
@@ -65,15 +186,11 @@ class Distribution:
         """Returns a triangular distribution. The peak is at 'center' and it is
            zero at center +/- half_width. center and half_width are integers."""
         w = int(half_width)
-        c = int(center)
-        values = []
-        for i in xrange(-w+1, 0):
-            values.append(w+i)
-        for i in xrange(0, w):
-            values.append(w-i)
-        d = Distribution(center-w+1, values)
-        d.normalize()
-        return d
+        def make_values():
+            values = (w - np.abs(np.arange(-w+1, w))).astype(float)
+            return values / np.sum(values)
+        values = kernel_cache.get(('triangle', w), make_values)
+        return Distribution(center-w+1, values, copy=False)
 
     @staticmethod
     def gaussian(mu, sigma, cut = 5.0):
@@ -81,12 +198,42 @@ class Distribution:
            sigma**2. For efficiency reasons, the tails are cut at
            cut * sigma, so with cut=5, it will fill the array from -5 sigma
            to +5 sigma."""
-        sigma2 = sigma * sigma
         extent = int(ceil(cut * sigma))
-        values = []
-        for x in xrange(mu - extent, mu + extent + 1):
-            values.append(exp((-0.5*(x-mu)*(x-mu))/sigma2))
-        d = Distribution(mu - extent, values)
+        def make_values():
+            x = np.arange(-extent, extent + 1)
+            values = np.exp((-0.5*x*x)/(sigma * sigma))
+            return values / np.sum(values)
+        values = kernel_cache.get(('gaussian', sigma, cut), make_values)
+        return Distribution(mu - extent, values, copy=False)
+
+    @staticmethod
+    def convolve(a, b, prune_epsilon = 0.0, prune_cumulative = True):
+        """Returns the convolution of the distributions a and b, which starts
+           at a.start() + b.start() and has len(a.values) + len(b.values) - 1
+           values. If prune_epsilon is larger than 0.0, the result is pruned
+           (see prune), and its pruned_mass is the removed mass."""
+        d = Distribution(a.offset + b.offset,
+                         convolve_values(a.values, b.values))
+        if prune_epsilon > 0.0:
+            d.prune(prune_epsilon, prune_cumulative)
+        d.normalize()
+        return d
+
+    @staticmethod
+    def multiply(a, b, prune_epsilon = 0.0, prune_cumulative = True):
+        """Returns the (normalized) product of the distributions a and b.
+           Since the product is zero outside of the intersection of a and b,
+           only the intersection is computed. If a and b do not intersect,
+           the result is a single zero value. Pruning as in convolve."""
+        start = max(a.start(), b.start())
+        stop = min(a.stop(), b.stop())
+        if stop <= start:
+            return Distribution(start, [0.0])
+        d = Distribution(start,
+                         a.values[start - a.start():stop - a.start()] *
+                         b.values[start - b.start():stop - b.start()])
+        if prune_epsilon > 0.0:
+            d.prune(prune_epsilon, prune_cumulative)
         d.normalize()
         return d
 
@@ -96,17 +243,16 @@ class Distribution:
            objects). If weights (a list) is specified, it must specify one float
            value for each distribution."""
         # If weights are not given, generate them, all 1.0's.
-        if not weights:
+        if weights is None:
             weights = [1.0 for d in distributions]
-        # First make an all-zero list which covers all indices.
+        # First make an all-zero array which covers all indices.
         start = min([d.start() for d in distributions])
         stop  = max([d.stop() for d in distributions])
-        sum_dist = [0.0 for _ in xrange(start, stop)]
-        for i in xrange(len(distributions)):
-            dist = distributions[i]
+        sum_dist = np.zeros(stop - start)
+        for dist, weight in zip(distributions, weights):
             # Now weight all values and add them to sum_dist.
-            for j in xrange(len(dist.values)):
-                sum_dist[dist.start()-start+j] += dist.values[j] * weights[i]
+            sum_dist[dist.start()-start:dist.stop()-start] += \
+                weight * dist.values
         d = Distribution(start, sum_dist)
         Distribution.normalize(d)
         return d
@@ -0,0 +1,190 @@
+# Discrete distribution in log space: holds the logarithms of the values
+# for the indices 'start', 'start'+1, ... 'start'+len(log_values)-1, and
+# -inf (log of 0.0) for all other indices.
+# Multiplying two distributions is an addition of the log values, and
+# normalizing subtracts their log-sum-exp. So, a product of sharp
+# distributions which would underflow to all zeros in a Distribution
+# (after which normalize does nothing) is still represented exactly.
+from math import ceil, log
+import numpy as np
+import distribution
+from distribution import Distribution, convolve_values
+
+
+# Returns log(sum(exp(log_values))), without overflow or underflow, and -inf
+# if all log_values are -inf (or there are none).
+def logsumexp(log_values):
+    if len(log_values) == 0:
+        return -np.inf
+    m = np.max(log_values)
+    if not np.isfinite(m):
+        return m
+    return m + log(np.sum(np.exp(log_values - m)))
+
+
+class LogDistribution:
+    """This class represents a discrete distribution by its log values."""
+    def __init__(self, offset = 0, log_values = [0.0]):
+        self.offset = offset
+        self.log_values = np.array(log_values, dtype=float)
+
+    def __repr__(self):
+        s = "start = %d, log values =" % self.offset
+        for x in self.log_values:
+            s += " %f" % x
+        return s
+
+    def start(self):
+        return self.offset
+
+    def stop(self):
+        """Return the stop point of the distribution, which is the first index
+           'outside' the distribution."""
+        return self.offset + len(self.log_values)
+
+    def normalize(self):
+        """Normalizes the distribution so that the sum of all values (not log
+           values) is 1.0. Returns the log of the sum before normalization,
+           which is -inf if all values are zero (which are not changed)."""
+        s = logsumexp(self.log_values)
+        if np.isfinite(s):
+            self.log_values = self.log_values - s
+        return s
+
+    def log_value(self, index):
+        """Returns the log value at index, -inf outside of the distribution.
+           index may also be an array of indices."""
+        index = np.asarray(index) - self.offset
+        inside = (index >= 0) & (index < len(self.log_values))
+        if index.ndim == 0:
+            return float(self.log_values[index]) if inside else -np.inf
+        result = np.empty(index.shape)
+        result.fill(-np.inf)
+        result[inside] = self.log_values[index[inside]]
+        return result
+
+    def value(self, index):
+        """Returns the value (not the log value) at index."""
+        return np.exp(self.log_value(index))
+
+    def plotlists(self, start = None, stop = None):
+        if start == None:
+            start = self.start()
+        if stop == None:
+            stop = self.stop()
+        if start <= stop:
+            indices = np.arange(start, stop)
+            return ((indices + 0.5).tolist(),
+                    np.exp(self.log_value(indices)).tolist())
+        else:
+            return ([], [])
+
+    def to_distribution(self):
+        """Returns the Distribution of the (normalized) values. Values which
+           are too small compared to the largest one become 0.0."""
+        d = Distribution(self.offset, np.exp(self.log_values -
+                                             np.max(self.log_values)))
+        d.normalize()
+        return d
+
+    @staticmethod
+    def from_distribution(distribution):
+        """Returns the LogDistribution of a Distribution. Zeros become
+           -inf."""
+        with np.errstate(divide='ignore'):
+            return LogDistribution(distribution.offset,
+                                   np.log(distribution.values))
+
+    @staticmethod
+    def unit_pulse(center):
+        """Returns a unit pulse at center."""
+        return LogDistribution(center, [0.0])
+
+    @staticmethod
+    def triangle(center, half_width):
+        """Returns a triangular distribution, same as Distribution.triangle."""
+        w = int(half_width)
+        d = LogDistribution(center-w+1, np.log(w - np.abs(np.arange(-w+1, w))))
+        d.normalize()
+        return d
+
+    @staticmethod
+    def gaussian(mu, sigma, cut = 5.0):
+        """Returns a gaussian distribution, same as Distribution.gaussian,
+           but the log values are computed directly, so that cut may be
+           large without any underflow."""
+        extent = int(ceil(cut * sigma))
+        x = np.arange(-extent, extent + 1)
+        d = LogDistribution(mu - extent, (-0.5*x*x)/(sigma * sigma))
+        d.normalize()
+        return d
+
+    @staticmethod
+    def multiply(a, b):
+        """Returns the (normalized) product of a and b, i.e. the sum of their
+           log values on the intersection of a and b. If they do not
+           intersect, the result is a single -inf (zero) value."""
+        start = max(a.start(), b.start())
+        stop = min(a.stop(), b.stop())
+        if stop <= start:
+            return LogDistribution(start, [-np.inf])
+        d = LogDistribution(start,
+            a.log_values[start - a.start():stop - a.start()] +
+            b.log_values[start - b.start():stop - b.start()])
+        d.normalize()
+        return d
+
+    @staticmethod
+    def convolve(a, b, exact = True):
+        """Returns the (normalized) convolution of a and b.
+           If exact is True, every output value is the log-sum-exp of the
+           sums of log values, which never underflows. This takes one
+           (vectorized) np.logaddexp per value of the shorter distribution.
+           Otherwise, see convolve_shifted."""
+        if not exact:
+            return LogDistribution.convolve_shifted(a, b)
+        if len(a.log_values) < len(b.log_values):
+            a, b = b, a
+        n = len(a.log_values)
+        log_values = np.empty(n + len(b.log_values) - 1)
+        log_values.fill(-np.inf)
+        for j, lb in enumerate(b.log_values):
+            if lb > -np.inf:
+                np.logaddexp(log_values[j:j+n], a.log_values + lb,
+                             out=log_values[j:j+n])
+        return LogDistribution.trimmed(a.offset + b.offset, log_values)
+
+    @staticmethod
+    def convolve_shifted(a, b):
+        """Returns the (normalized) convolution of a and b.
+           Both are shifted so that their maximum log value is 0.0 before
+           they are converted to values, so nothing overflows and the
+           largest values cannot underflow. The values are convolved with
+           convolve_values (direct or FFT), and converted back to log
+           values. This is fast, but values below about 1e-300 (direct) or
+           1e-15 (FFT) of the maximum become -inf."""
+        ma, mb = np.max(a.log_values), np.max(b.log_values)
+        if not (np.isfinite(ma) and np.isfinite(mb)):
+            return LogDistribution(a.offset + b.offset, [-np.inf])
+        values = convolve_values(np.exp(a.log_values - ma),
+                                 np.exp(b.log_values - mb))
+        if min(len(a.log_values), len(b.log_values)) >= \
+           distribution.fft_threshold:
+            # The error of the FFT is relative to the largest value, so
+            # smaller values are noise.
+            values[values < 1e-15 * np.max(values)] = 0.0
+        with np.errstate(divide='ignore'):
+            return LogDistribution.trimmed(a.offset + b.offset,
+                                           np.log(values))
+
+    @staticmethod
+    def trimmed(offset, log_values):
+        """Returns the normalized LogDistribution of log_values, starting at
+           offset, without the leading and trailing -inf values."""
+        finite = np.flatnonzero(log_values > -np.inf)
+        if len(finite) == 0:
+            return LogDistribution(offset, [-np.inf])
+        first, last = finite[0], finite[-1] + 1
+        d = LogDistribution(offset + first, log_values[first:last])
+        d.normalize()
+        return d
@@ -22,21 +22,9 @@ def convolve(a, b):
 
     # --->>> Put your code here.
 
-    # offset for next step
-    offset = a.offset + b.offset;
-
-    # init the distri_list
-    distri_list = []
-
-    # calculate several distributions according to the number of a
-    for a_value in a.values:
-        distri_value = []
-        for b_value in b.values:
-            distri_value.append(a_value * b_value)
-        distri_list.append(Distribution(offset, distri_value))
-        offset += 1
-
-    return Distribution.sum(distri_list)
+    # The result starts at a.offset + b.offset. Distribution.convolve
+    # chooses between direct and FFT convolution, depending on the lengths.
+    return Distribution.convolve(a, b)
 
 
 if __name__ == '__main__':
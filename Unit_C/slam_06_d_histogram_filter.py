@@ -19,45 +19,24 @@ def move(distribution, delta):
     return new_distribution  # Replace this by your own result.
 
 
-def convolve(a, b):
+def convolve(a, b, prune_epsilon = 0.0):
     """Convolve distribution a and b and return the resulting new distribution."""
 
     # --->>> Copy your previous code here.
 
-    # offset for next step
-    offset = a.offset + b.offset;
+    # The result starts at a.offset + b.offset. Distribution.convolve
+    # chooses between direct and FFT convolution, depending on the lengths.
+    # If prune_epsilon is larger than 0.0, the tails are pruned.
+    return Distribution.convolve(a, b, prune_epsilon)
 
-    # init the distri_list
-    distri_list = []
 
-    # calculate several distributions according to the number of a
-    for a_value in a.values:
-        distri_value = []
-        for b_value in b.values:
-            distri_value.append(a_value * b_value)
-        distri_list.append(Distribution(offset, distri_value))
-        offset += 1
-
-    return Distribution.sum(distri_list)
-
-
-def multiply(a, b):
+def multiply(a, b, prune_epsilon = 0.0):
     """Multiply two distributions and return the resulting distribution."""
 
     # --->>> Copy your previous code here.
-    start = min([a.start(), b.start()])
-    stop = max([a.stop(), b.stop()])
-
-    values = []
-
-    for i in range(start, stop):
-        values.append(a.value(i) * b.value(i))
-
-    result_distri = Distribution(start, values)
-
-    result_distri.normalize()
-
-    return result_distri
+    # The product is zero outside of the intersection of a and b, so
+    # Distribution.multiply computes the intersection only.
+    return Distribution.multiply(a, b, prune_epsilon)
 
 
 if __name__ == '__main__':
@@ -25,11 +25,11 @@ def histogram_plot(prediction, measurement, correction):
 #
 # Histogram filter step.
 #
-def histogram_filter_step(belief, control, measurement):
+def histogram_filter_step(belief, control, measurement, prune_epsilon = 0.0):
     """Bayes filter step implementation: histogram filter."""
     # These two lines is the entire filter!
-    prediction = convolve(belief, control)
-    correction = multiply(prediction, measurement)
+    prediction = convolve(belief, control, prune_epsilon)
+    correction = multiply(prediction, measurement, prune_epsilon)
 
     # Return both prediction and corrrection. This is for plotting only.
     # Normally, this would just return the correction.
@@ -50,11 +50,23 @@ if __name__ == '__main__':
     controls = [ Dist(40, 10), Dist(70, 10) ]
     measurements = [ Dist(60, 10), Dist(140, 20) ]
 
+    # Prune the tails of the beliefs, so that their support (and the cost
+    # of a step) stays bounded, no matter how long the filter runs.
+    prune_epsilon = 1e-9
+    # Sum of the (relative) masses pruned in all steps so far.
+    total_pruned_mass = 0.0
+
     # This is the filter loop.
     for i in xrange(len(controls)):
         # Call the filter step. The corrected distribution becomes the new position.
-        (prediction, position) = histogram_filter_step(position, controls[i], measurements[i])
+        (prediction, position) = histogram_filter_step(position, controls[i], measurements[i],
+                                                       prune_epsilon)
         histogram_plot(prediction, measurements[i], position)
+        total_pruned_mass += prediction.pruned_mass + position.pruned_mass
+        print "Step %d: support %d, pruned mass %g, total pruned mass %g" % \
+            (i, len(position.values),
+             prediction.pruned_mass + position.pruned_mass,
+             total_pruned_mass)
 
     ylim(0.0, 0.16)
     show()
@@ -22,40 +22,18 @@ def convolve(a, b):
 
     # --->>> Put your code here.
 
-    # offset for next step
-    offset = a.offset + b.offset;
-
-    # init the distri_list
-    distri_list = []
-
-    # calculate several distributions according to the number of a
-    for a_value in a.values:
-        distri_value = []
-        for b_value in b.values:
-            distri_value.append(a_value * b_value)
-        distri_list.append(Distribution(offset, distri_value))
-        offset += 1
-
-    return Distribution.sum(distri_list)
+    # The result starts at a.offset + b.offset. Distribution.convolve
+    # chooses between direct and FFT convolution, depending on the lengths.
+    return Distribution.convolve(a, b)
 
 
 def multiply(a, b):
     """Multiply two distributions and return the resulting distribution."""
 
     # --->>> Put your code here.
-    start = min([a.start(), b.start()])
-    stop = max([a.stop(), b.stop()])
-
-    values = []
-
-    for i in range(start, stop):
-        values.append(a.value(i) * b.value(i))
-
-    result_distri = Distribution(start, values)
-
-    result_distri.normalize()
-
-    return result_distri
+    # The product is zero outside of the intersection of a and b, so
+    # Distribution.multiply computes the intersection only.
+    return Distribution.multiply(a, b)
 
 #
 # Helpers.
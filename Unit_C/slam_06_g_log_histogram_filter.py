@@ -0,0 +1,76 @@
+# Histogram filter in log space, compared to the histogram filter.
+# The robot is kidnapped: it moves much farther than the control says, so
+# the measurements are far off the prediction. The histogram filter's
+# product underflows to all zeros, and the filter never recovers. The log
+# space filter represents the tiny product exactly. Since all distributions
+# are gaussians, its mean must be equal to the mean of a Kalman filter,
+# which is printed for comparison.
+# 06_g_log_histogram_filter
+from pylab import plot, show, ylim
+import numpy as np
+from distribution import *
+from log_distribution import *
+
+
+def mean(distribution):
+    """Returns the mean of a distribution (Distribution or LogDistribution),
+       or None if it is all zero."""
+    indices = np.arange(distribution.start(), distribution.stop())
+    values = distribution.value(indices)
+    if np.sum(values) == 0.0:
+        return None
+    return np.sum(indices * values) / np.sum(values)
+
+
+if __name__ == '__main__':
+    arena = (0, 600)
+    # The gaussians are cut far out, so that they still overlap after the
+    # kidnapping. In the histogram filter, the values out there are zero
+    # anyway (they underflow).
+    cut = 60.0
+    control_sigma, measurement_sigma = 5.0, 2.0
+
+    # Start position, controls and (sharp) measurements. In step 3, the
+    # robot moves by 320 instead of 20.
+    position = Distribution.gaussian(10, 2, cut)
+    log_position = LogDistribution.gaussian(10, 2, cut)
+    kalman_mu, kalman_sigma2 = 10.0, 2.0**2
+    controls = [20] * 10
+    true_positions = []
+    p = 10
+    for i, c in enumerate(controls):
+        p += c + (300 if i == 3 else 0)
+        true_positions.append(p)
+
+    for i in xrange(len(controls)):
+        # Histogram filter.
+        prediction = Distribution.convolve(
+            position, Distribution.gaussian(controls[i], control_sigma, cut))
+        position = Distribution.multiply(
+            prediction, Distribution.gaussian(true_positions[i],
+                                              measurement_sigma, cut))
+        # Log space histogram filter.
+        log_prediction = LogDistribution.convolve(
+            log_position,
+            LogDistribution.gaussian(controls[i], control_sigma, cut))
+        log_position = LogDistribution.multiply(
+            log_prediction, LogDistribution.gaussian(true_positions[i],
+                                                     measurement_sigma, cut))
+        # Kalman filter.
+        kalman_mu += controls[i]
+        kalman_sigma2 += control_sigma**2
+        k = kalman_sigma2 / (kalman_sigma2 + measurement_sigma**2)
+        kalman_mu += k * (true_positions[i] - kalman_mu)
+        kalman_sigma2 *= 1.0 - k
+
+        print "Step %d: true %d, histogram %s, log histogram %s, kalman %s" %\
+            (i, true_positions[i], mean(position), mean(log_position),
+             kalman_mu)
+        plot(position.plotlists(*arena)[0], position.plotlists(*arena)[1],
+             color='b', linestyle='steps')
+        plot(log_position.plotlists(*arena)[0],
+             log_position.plotlists(*arena)[1],
+             color='r', linestyle='steps')
+
+    ylim(0.0, 0.25)
+    show()
@@ -0,0 +1,98 @@
+# Benchmark of the histogram filter and the Kalman filter of slam_06_f, on
+# synthetic sequences of controls and measurements. The same sequence (in
+# mm) is run with histogram cells of different widths, and with different
+# noise (the sigma of the control and measurement kernels, in mm).
+# For every combination, prints the time per step of both filters, the
+# largest size of the histogram's belief arrays (the values of the
+# prediction and the correction, in one step; kernels, FFT buffers and
+# temporaries are not counted, so this is not the peak memory of the
+# process), and the largest difference of the histogram's mean and
+# variance to the Kalman filter's Density. Since all distributions are
+# gaussians, the Kalman filter is exact, so this is the error caused by
+# the histogram representation (cells, and gaussians cut at 5 sigma).
+#
+# slam_06_h_histogram_vs_kalman_benchmark
+import random
+import timeit
+import numpy as np
+from distribution import Distribution
+from slam_06_f_kalman_vs_histogram_filter_question import \
+    histogram_filter_step, kalman_filter_step, Density
+
+
+# Returns a list of steps (control, measurement), in mm. The robot moves
+# by about motion per step, and the measurements have the given sigma.
+def make_sequence(length, start, motion, control_sigma, measurement_sigma):
+    steps = []
+    position = start
+    for i in xrange(length):
+        control = random.gauss(motion, 0.2 * motion)
+        position += random.gauss(control, control_sigma)
+        steps.append((control, random.gauss(position, measurement_sigma)))
+    return steps
+
+# Runs both filters on the sequence, with the given cell width (in mm).
+# Controls and measurements are rounded to cells, for both filters.
+# Returns (histogram time per step, kalman time per step, belief bytes, max
+# mean error in mm, max relative variance error).
+def run(sequence, start, start_sigma, cell_width, control_sigma,
+        measurement_sigma):
+    w = float(cell_width)
+    belief = Distribution.gaussian(int(round(start / w)), start_sigma / w)
+    density = Density(round(start / w) * w, start_sigma ** 2)
+    histogram_time = kalman_time = 0.0
+    belief_bytes = 0
+    mean_error = variance_error = 0.0
+    for control, measurement in sequence:
+        c, m = int(round(control / w)), int(round(measurement / w))
+
+        t = timeit.default_timer()
+        prediction, belief = histogram_filter_step(
+            belief, Distribution.gaussian(c, control_sigma / w),
+            Distribution.gaussian(m, measurement_sigma / w))
+        histogram_time += timeit.default_timer() - t
+        belief_bytes = max(belief_bytes,
+                           prediction.values.nbytes + belief.values.nbytes)
+
+        t = timeit.default_timer()
+        density = kalman_filter_step(
+            density, Density(c * w, control_sigma ** 2),
+            Density(m * w, measurement_sigma ** 2))[1]
+        kalman_time += timeit.default_timer() - t
+
+        # Mean and variance of the histogram, in mm.
+        x = np.arange(belief.start(), belief.stop()) * w
+        mean = np.sum(x * belief.values)
+        variance = np.sum((x - mean) ** 2 * belief.values)
+        mean_error = max(mean_error, abs(mean - density.mu))
+        variance_error = max(variance_error,
+                             abs(variance - density.sigma2) / density.sigma2)
+
+    n = len(sequence)
+    return (histogram_time / n, kalman_time / n, belief_bytes,
+            mean_error, variance_error)
+
+
+if __name__ == '__main__':
+    # Sweep parameters: cell widths (mm), sigma of the control and the
+    # measurement (mm), and number of steps.
+    cell_widths = [1, 5, 20]
+    sigmas = [10, 50, 200]
+    lengths = [10, 100, 1000]
+    start, start_sigma, motion = 0.0, 20.0, 100.0
+
+    random.seed(0)
+    print "%6s %6s %6s %12s %12s %10s %12s %12s" % \
+        ("cell", "sigma", "steps", "hist ms", "kalman ms", "belief KB",
+         "mean err mm", "var err %")
+    for length in lengths:
+        for sigma in sigmas:
+            sequence = make_sequence(length, start, motion, sigma, sigma)
+            for w in cell_widths:
+                histogram_time, kalman_time, belief_bytes, mean_error, \
+                    variance_error = run(sequence, start, start_sigma, w,
+                                         sigma, sigma)
+                print "%6d %6d %6d %12.3f %12.4f %10.1f %12.2f %12.1f" % \
+                    (w, sigma, length, histogram_time * 1000.0,
+                     kalman_time * 1000.0, belief_bytes / 1024.0, mean_error,
+                     variance_error * 100.0)
@@ -0,0 +1,214 @@
+# Scan-to-scan odometry: estimates the motion of the robot between two
+# consecutive scans by registering the new scan to the previous one, using
+# point-to-line ICP. This is an alternative to the motor ticks, which are
+# unreliable if the wheels slip.
+# The previous scan is the reference. Its points are stored in a kd-tree,
+# and each point gets the normal of the line through its two neighbours in
+# the scan (points next to a depth jump get none, and are not used).
+# The motion is returned as (dx, dy, dtheta) of the robot center, in the
+# robot's coordinate system at the time of the previous scan, together with
+# its 3x3 covariance, as needed by ExtendedKalmanFilter.predict_motion.
+# On robot4, the estimated motion is biased towards small motions, compared
+# to the reference trajectory:
+# - The ranges of the scanner are about 5.5% too short (a fit of the
+#   cylinder distances to the reference positions gives 0.945 times the
+#   true distance, plus a constant offset), so all translations are too
+#   short as well. range_scale corrects this.
+# - The rotation is about 6% too small (637 instead of 680 deg in total).
+#   About half of this is due to the robot's motion during the sweep of the
+#   scanner (de-skewing the scans, assuming the sweep takes the whole time
+#   between two scans, gives 655 deg). Since the sweep timing is unknown,
+#   this is not corrected. Instead, the heading variance is increased in
+#   proportion to the rotation (rotation_factor), as the turn error of the
+#   motion model.
+# (The difference to the motor ticks is larger, about 3 deg per step, but
+# this is mostly due to the ticks: every fourth motor record is zero.)
+from math import sin, cos, sqrt
+import numpy as np
+from scipy.spatial import cKDTree
+from lego_robot import LegoLogfile
+
+
+# Returns the (n, 2) array of the points of a scan, in the scanner's
+# coordinate system, skipping all invalid measurements. The ranges are
+# multiplied by range_scale.
+def scan_to_points(scan, min_valid_distance = 20.0, range_scale = 1.0):
+    scan = np.asarray(scan, dtype=float)
+    valid = np.flatnonzero(scan > min_valid_distance)
+    angles = LegoLogfile.beam_index_to_angle(valid)
+    ranges = scan[valid] * range_scale
+    return np.column_stack((ranges * np.cos(angles),
+                            ranges * np.sin(angles)))
+
+
+# Returns the (n, 2) array of unit normals of the scan points, and a boolean
+# array which is False for points whose neighbours are farther away than
+# max_gap, e.g. at the edges of a cylinder.
+def scan_normals(points, max_gap):
+    normals = np.zeros(points.shape)
+    valid = np.zeros(len(points), dtype=bool)
+    if len(points) < 3:
+        return normals, valid
+    before = points[1:-1] - points[:-2]
+    after = points[2:] - points[1:-1]
+    tangent = points[2:] - points[:-2]
+    length = np.hypot(tangent[:, 0], tangent[:, 1])
+    valid[1:-1] = (np.hypot(before[:, 0], before[:, 1]) < max_gap) & \
+                  (np.hypot(after[:, 0], after[:, 1]) < max_gap) & \
+                  (length > 0.0)
+    length[length == 0.0] = 1.0
+    normals[1:-1, 0] = -tangent[:, 1] / length
+    normals[1:-1, 1] = tangent[:, 0] / length
+    return normals, valid
+
+
+class ScanOdometry(object):
+    """Estimates the motion between consecutive scans.
+       max_distance is the maximum distance of corresponding points,
+       max_gap the maximum distance of neighbouring scan points used to
+       compute a normal, min_points the minimum number of point pairs needed
+       for a valid estimate. If the estimate is not valid, the motion of the
+       previous step is returned, with fallback_covariance.
+       range_scale is multiplied to all ranges of the scanner (1.06 for
+       robot4, see above). The covariance of the rotation is only based on
+       the residuals and thus too small, since the rotation is biased;
+       (rotation_factor * dtheta)^2 is added to its variance."""
+    def __init__(self, scanner_displacement, max_distance = 100.0,
+                 max_gap = 50.0, max_iterations = 15,
+                 min_translation = 0.1, min_rotation = 1e-4,
+                 min_points = 20, min_valid_distance = 20.0,
+                 measurement_stddev = 200.0,
+                 fallback_covariance = np.diag([100.0**2, 100.0**2, 0.1**2]),
+                 range_scale = 1.0, rotation_factor = 0.2):
+        self.scanner_displacement = scanner_displacement
+        self.max_distance = max_distance
+        self.max_gap = max_gap
+        self.max_iterations = max_iterations
+        self.min_translation = min_translation
+        self.min_rotation = min_rotation
+        self.min_points = min_points
+        self.min_valid_distance = min_valid_distance
+        self.measurement_stddev = measurement_stddev
+        self.fallback_covariance = fallback_covariance
+        self.range_scale = range_scale
+        self.rotation_factor = rotation_factor
+
+        # The reference (previous) scan.
+        self.reference = None
+        self.reference_normals = None
+        self.tree = None
+        # The scanner motion of the last step, used as the initial guess.
+        self.last_scanner_motion = np.zeros(3)
+        # Statistics of the last step.
+        self.iterations = 0
+        self.pairs = 0
+        self.valid = False
+
+    def set_reference(self, points):
+        normals, valid = scan_normals(points, self.max_gap)
+        self.reference = points[valid]
+        self.reference_normals = normals[valid]
+        self.tree = cKDTree(self.reference) if len(self.reference) else None
+
+    def register(self, points, initial_motion):
+        """Point-to-line ICP of points against the reference scan.
+           Returns the scanner motion (dx, dy, dtheta), the 3x3 information
+           matrix A^T A of the last linearization (without the measurement
+           variance) and the number of pairs, or None if the motion can not
+           be determined."""
+        motion = np.array(initial_motion, dtype=float)
+        A = None
+        pairs = 0
+        self.iterations = 0
+        while self.iterations < self.max_iterations:
+            self.iterations += 1
+            c, s = cos(motion[2]), sin(motion[2])
+            moved = np.column_stack(
+                (c * points[:, 0] - s * points[:, 1] + motion[0],
+                 s * points[:, 0] + c * points[:, 1] + motion[1]))
+            distances, indices = self.tree.query(
+                moved, distance_upper_bound=self.max_distance)
+            found = np.isfinite(distances)
+            pairs = np.count_nonzero(found)
+            if pairs < self.min_points:
+                return None
+            p = moved[found]
+            q = self.reference[indices[found]]
+            n = self.reference_normals[indices[found]]
+
+            # Linearized point-to-line step for (tx, ty, angle), with the
+            # rotation around the center of the points.
+            center = np.mean(p, axis=0)
+            pc = p - center
+            A = np.column_stack((n[:, 0], n[:, 1],
+                                 n[:, 1] * pc[:, 0] - n[:, 0] * pc[:, 1]))
+            b = np.sum(n * (q - p), axis=1)
+            x = np.linalg.lstsq(np.dot(A.T, A), np.dot(A.T, b),
+                                rcond=1e-10)[0]
+
+            # Compose the increment with the motion so far.
+            ci, si = cos(x[2]), sin(x[2])
+            tx = center[0] + x[0] - (ci * center[0] - si * center[1])
+            ty = center[1] + x[1] - (si * center[0] + ci * center[1])
+            motion = np.array([ci * motion[0] - si * motion[1] + tx,
+                               si * motion[0] + ci * motion[1] + ty,
+                               motion[2] + x[2]])
+            if abs(x[2]) < self.min_rotation and \
+               sqrt(tx * tx + ty * ty) < self.min_translation:
+                break
+
+        # Information matrix of (dx, dy, dtheta), i.e. for the rotation
+        # around the origin of the scanner instead of the center of the
+        # points, for the covariance of the motion.
+        c, s = cos(motion[2]), sin(motion[2])
+        r = points[found]
+        rx = c * r[:, 0] - s * r[:, 1]
+        ry = s * r[:, 0] + c * r[:, 1]
+        A = np.column_stack((n[:, 0], n[:, 1], n[:, 1] * rx - n[:, 0] * ry))
+        return motion, np.dot(A.T, A), pairs
+
+    def scanner_to_robot_motion(self, scanner_motion, covariance):
+        """Converts the motion of the scanner to the motion of the robot
+           center, which is scanner_displacement behind the scanner."""
+        dx, dy, dtheta = scanner_motion
+        d = self.scanner_displacement
+        motion = np.array([dx + d - d * cos(dtheta),
+                           dy - d * sin(dtheta),
+                           dtheta])
+        J = np.array([[1.0, 0.0, d * sin(dtheta)],
+                      [0.0, 1.0, -d * cos(dtheta)],
+                      [0.0, 0.0, 1.0]])
+        return motion, np.dot(np.dot(J, covariance), J.T)
+
+    def step(self, scan):
+        """Takes the next scan and returns (motion, covariance), the motion
+           of the robot since the previous scan, as (dx, dy, dtheta) in the
+           robot's previous coordinate system, and its 3x3 covariance.
+           For the first scan, the motion is zero."""
+        points = scan_to_points(scan, self.min_valid_distance,
+                                self.range_scale)
+        if self.tree is None:
+            self.set_reference(points)
+            self.valid = False
+            self.iterations = self.pairs = 0
+            return np.zeros(3), self.fallback_covariance.copy()
+
+        result = self.register(points, self.last_scanner_motion)
+        if result is None:
+            self.valid = False
+            self.pairs = 0
+            scanner_motion = self.last_scanner_motion
+            covariance = self.fallback_covariance
+        else:
+            self.valid = True
+            scanner_motion, information, self.pairs = result
+            # The residuals are assumed to be independent, with
+            # measurement_stddev. Information in unconstrained directions
+            # (e.g. along a single wall) is bounded by the fallback.
+            information = information / self.measurement_stddev ** 2 + \
+                np.linalg.inv(self.fallback_covariance)
+            covariance = np.linalg.inv(information)
+            covariance[2, 2] += (self.rotation_factor * scanner_motion[2]) ** 2
+            self.last_scanner_motion = scanner_motion
+        self.set_reference(points)
+        return self.scanner_to_robot_motion(scanner_motion, covariance)
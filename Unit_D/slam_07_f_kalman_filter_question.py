@@ -5,7 +5,8 @@
 from lego_robot import *
 from math import sin, cos, pi, atan2, sqrt
 from numpy import *
-from slam_d_library import get_observations, write_cylinders
+from slam_d_library import get_observations, get_observations_gated,\
+    write_cylinders, chi2_gate_2dof, predict_measurements
 
 
 class ExtendedKalmanFilter:
@@ -161,6 +162,25 @@ class ExtendedKalmanFilter:
         self.state = self.g(self.state, control, self.robot_width)
         self.covariance = (G.dot(self.covariance)).dot(G.transpose()) + R
 
+    def predict_motion(self, motion, motion_covariance):
+        """Prediction step using a measured motion (dx, dy, dtheta) in the
+           robot's coordinate system, with its 3x3 covariance, e.g. from
+           scan odometry, instead of the motor ticks."""
+        x, y, theta = self.state
+        dx, dy, dtheta = motion
+        c, s = cos(theta), sin(theta)
+        G = array([[1.0, 0.0, -s * dx - c * dy],
+                   [0.0, 1.0, c * dx - s * dy],
+                   [0.0, 0.0, 1.0]])
+        V = array([[c, -s, 0.0],
+                   [s, c, 0.0],
+                   [0.0, 0.0, 1.0]])
+        self.state = array([x + c * dx - s * dy,
+                            y + s * dx + c * dy,
+                            (theta + dtheta + pi) % (2*pi) - pi])
+        self.covariance = dot(dot(G, self.covariance), G.T) + \
+                          dot(dot(V, motion_covariance), V.T)
+
     @staticmethod
     def h(state, landmark, scanner_displacement):
         """Takes a (x, y, theta) state and a (x, y) landmark, and returns the
@@ -231,6 +251,33 @@ class ExtendedKalmanFilter:
         self.state = self.state + dot(K, innovation)
         self.covariance = (eye(3, 3) - dot(K, H)).dot(self.covariance)
 
+    def correct_batch(self, measurements, landmarks):
+        """The correction step for all k measurements of a scan at once.
+           measurements[i] is the (range, bearing) of landmarks[i]. H (2k x 3)
+           stacks the derivatives of all measurements, and Q is diagonal, so
+           it is block-diagonal with the 2x2 measurement covariance. Instead
+           of inverting the innovation covariance S = H P HT + Q, K is
+           obtained by a Cholesky solve. All measurements are linearized at
+           the same state, so the result differs slightly from calling
+           correct for each measurement."""
+        # Only this method needs scipy, so it is imported here.
+        from scipy.linalg import cho_factor, cho_solve
+        if len(landmarks) == 0:
+            return
+        z, H = predict_measurements(self.state, landmarks,
+                                    self.scanner_displacement)
+        H = H.reshape(-1, 3)
+        Q = diag(tile([self.measurement_distance_stddev**2,
+                       self.measurement_angle_stddev**2], len(z)))
+        PHT = dot(self.covariance, H.T)
+        S = dot(H, PHT) + Q
+        innovation = array(measurements, dtype=float) - z
+        innovation[:, 1] = (innovation[:, 1] + pi) % (2*pi) - pi
+        # K = P HT S^-1, so KT = S^-1 H P, since P and S are symmetric.
+        KT = cho_solve(cho_factor(S), PHT.T)
+        self.state = self.state + dot(innovation.ravel(), KT)
+        self.covariance = self.covariance - dot(PHT, KT)
+
 if __name__ == '__main__':
     # Robot constants.
     scanner_displacement = 30.0
@@ -242,6 +289,23 @@ if __name__ == '__main__':
     depth_jump = 100.0
     cylinder_offset = 90.0
     max_cylinder_distance = 300.0
+    # If True, cylinders are assigned using their Mahalanobis distance in
+    # measurement space, gated by mahalanobis_gate, instead of using
+    # max_cylinder_distance.
+    use_mahalanobis_gate = False
+    mahalanobis_gate = chi2_gate_2dof
+    # If True, the motion is estimated by scan-to-scan ICP instead of using
+    # the motor ticks.
+    use_scan_odometry = False
+    # Error of a single pair of scan points. This is much larger than the
+    # range error, since the errors of neighbouring pairs are correlated.
+    scan_odometry_stddev = 200.0
+    # The ranges of the scanner are about 5.5% too short (see
+    # scan_odometry.py), which makes the scan odometry too short as well.
+    scan_odometry_range_scale = 1.06
+    # If True, all observations of a scan are used in one correction step
+    # (correct_batch), otherwise one after the other.
+    use_batch_correction = False
 
     # Filter constants.
     control_motion_factor = 0.35  # Error in motor control.
@@ -260,6 +324,14 @@ if __name__ == '__main__':
                               measurement_distance_stddev,
                               measurement_angle_stddev)
 
+    if use_scan_odometry:
+        # Scan odometry (and scipy, which it needs) is only imported if used.
+        from scan_odometry import ScanOdometry
+        odometry = ScanOdometry(scanner_displacement,
+                                min_valid_distance = minimum_valid_distance,
+                                measurement_stddev = scan_odometry_stddev,
+                                range_scale = scan_odometry_range_scale)
+
     # Read data.
     logfile = LegoLogfile()
     logfile.read("robot4_motors.txt")
@@ -275,17 +347,30 @@ if __name__ == '__main__':
     matched_ref_cylinders = []
     for i in xrange(len(logfile.motor_ticks)):
         # Prediction.
-        control = array(logfile.motor_ticks[i]) * ticks_to_mm
-        kf.predict(control)
+        if use_scan_odometry:
+            kf.predict_motion(*odometry.step(logfile.scan_data[i]))
+        else:
+            control = array(logfile.motor_ticks[i]) * ticks_to_mm
+            kf.predict(control)
 
         # Correction.
-        observations = get_observations(
-            logfile.scan_data[i],
-            depth_jump, minimum_valid_distance, cylinder_offset,
-            kf.state, scanner_displacement,
-            reference_cylinders, max_cylinder_distance)
-        for j in xrange(len(observations)):
-            kf.correct(*observations[j])
+        if use_mahalanobis_gate:
+            observations = get_observations_gated(
+                logfile.scan_data[i],
+                depth_jump, minimum_valid_distance, cylinder_offset,
+                kf, reference_cylinders, mahalanobis_gate)
+        else:
+            observations = get_observations(
+                logfile.scan_data[i],
+                depth_jump, minimum_valid_distance, cylinder_offset,
+                kf.state, scanner_displacement,
+                reference_cylinders, max_cylinder_distance)
+        if use_batch_correction:
+            kf.correct_batch([o[0] for o in observations],
+                             [o[1] for o in observations])
+        else:
+            for j in xrange(len(observations)):
+                kf.correct(*observations[j])
 
         # Log state, covariance, and matched cylinders for later output.
         states.append(kf.state)
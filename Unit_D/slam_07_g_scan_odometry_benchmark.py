@@ -0,0 +1,66 @@
+# Benchmark of scan-to-scan odometry on the sample log: the time needed to
+# register each scan to the previous one, compared to the time between two
+# scans, and the estimated motion, compared to the motor ticks.
+#
+# slam_07_g_scan_odometry_benchmark
+from math import pi
+from numpy import *
+import timeit
+from lego_robot import LegoLogfile
+from scan_odometry import ScanOdometry
+
+
+# Returns the timestamps (in ms) of all scans in the given file.
+def read_scan_timestamps(filename):
+    timestamps = []
+    f = open(filename)
+    for l in f:
+        sp = l.split()
+        if sp and sp[0] == 'S':
+            timestamps.append(int(sp[1]))
+    f.close()
+    return array(timestamps)
+
+
+if __name__ == '__main__':
+    scanner_displacement = 30.0
+    ticks_to_mm = 0.349
+    robot_width = 155.0
+    minimum_valid_distance = 20.0
+    range_scale = 1.06  # See scan_odometry.py.
+
+    logfile = LegoLogfile()
+    logfile.read("robot4_motors.txt")
+    logfile.read("robot4_scan.txt")
+    timestamps = read_scan_timestamps("robot4_scan.txt")
+    scan_interval = median(diff(timestamps))
+
+    odometry = ScanOdometry(scanner_displacement,
+                            min_valid_distance = minimum_valid_distance,
+                            range_scale = range_scale)
+    times = []
+    iterations = []
+    motions = []
+    for scan in logfile.scan_data:
+        start = timeit.default_timer()
+        motion, covariance = odometry.step(scan)
+        times.append((timeit.default_timer() - start) * 1000.0)
+        iterations.append(odometry.iterations)
+        motions.append(motion)
+    times = array(times[1:])  # The first scan only sets the reference.
+    motions = array(motions)
+
+    print "Scans: %d, median time between scans: %.0f ms" % \
+        (len(logfile.scan_data), scan_interval)
+    print "Time per scan: mean %.2f ms, median %.2f ms, 95%% %.2f ms, max %.2f ms" % \
+        (mean(times), median(times), percentile(times, 95), max(times))
+    print "Mean ICP iterations: %.1f" % mean(iterations[1:])
+    print "Fraction of the time between scans used: %.1f%%" % \
+        (100.0 * mean(times) / scan_interval)
+
+    ticks = array(logfile.motor_ticks) * ticks_to_mm
+    print "Total distance: scans %.0f mm, ticks %.0f mm" % \
+        (sum(motions[:, 0]), sum(ticks) / 2.0)
+    print "Total rotation: scans %.1f deg, ticks %.1f deg" % \
+        (sum(motions[:, 2]) * 180.0 / pi,
+         sum(ticks[:, 1] - ticks[:, 0]) / robot_width * 180.0 / pi)
@@ -0,0 +1,193 @@
+# The extended Kalman filter of slam_07_f, in square-root form: instead of
+# the covariance P, the filter keeps an upper triangular factor U with
+# P = UT U (the transposed Cholesky factor). Both steps are done by a QR
+# decomposition of a stacked array, whose triangular part is the new
+# factor, so the covariance is symmetric and positive semidefinite by
+# construction, without any re-symmetrization.
+# - Prediction: P' = G P GT + V C VT = AT A, with A = [U GT; sqrt(C) VT].
+# - Correction: the QR decomposition of [[sqrt(Q), 0], [U HT, U]] gives
+#   the factor of S = H P HT + Q, the factor of the new covariance, and
+#   (with a triangular solve) the Kalman gain.
+# The main program runs the square-root filter and the normal filter on
+# the same data and compares them.
+#
+# slam_07_h_square_root_kalman_filter
+from lego_robot import *
+from math import sin, cos, pi, atan2, sqrt
+from numpy import *
+import timeit
+from slam_d_library import get_observations, write_cylinders,\
+    predict_measurements, covariance_factor, square_root_correction
+from slam_07_f_kalman_filter_question import ExtendedKalmanFilter
+
+
+class SquareRootExtendedKalmanFilter(ExtendedKalmanFilter, object):
+    """ExtendedKalmanFilter which keeps the factor U of the covariance
+       P = UT U. The covariance is still available (computed from U), and
+       setting it sets U."""
+    @property
+    def covariance(self):
+        return dot(self.factor.T, self.factor)
+
+    @covariance.setter
+    def covariance(self, covariance):
+        self.factor = covariance_factor(covariance)
+
+    @staticmethod
+    def get_error_ellipse(factor):
+        """Same as ExtendedKalmanFilter.get_error_ellipse, but computed from
+           the factor U (P = UT U) instead of the covariance. The singular
+           values of the first two columns of U are the standard
+           deviations, and the right singular vectors are the axes."""
+        u, s, vt = linalg.svd(factor[:, 0:2])
+        angle = atan2(vt[0, 1], vt[0, 0])
+        return (angle, s[0], s[1])
+
+    def predict(self, control):
+        """The prediction step of the Kalman filter."""
+        left, right = control
+        G = self.dg_dstate(self.state, control, self.robot_width)
+        V = self.dg_dcontrol(self.state, control, self.robot_width)
+        sigmal2 = (self.control_motion_factor * left) ** 2 + (self.control_turn_factor * (left - right)) ** 2
+        sigmar2 = (self.control_motion_factor * right) ** 2 + (self.control_turn_factor * (left - right)) ** 2
+        A = concatenate((dot(self.factor, G.T),
+                         sqrt([[sigmal2], [sigmar2]]) * V.T))
+        self.factor = linalg.qr(A, mode='r')
+        self.state = self.g(self.state, control, self.robot_width)
+
+    def predict_motion(self, motion, motion_covariance):
+        """Same as ExtendedKalmanFilter.predict_motion, in square-root
+           form."""
+        x, y, theta = self.state
+        dx, dy, dtheta = motion
+        c, s = cos(theta), sin(theta)
+        G = array([[1.0, 0.0, -s * dx - c * dy],
+                   [0.0, 1.0, c * dx - s * dy],
+                   [0.0, 0.0, 1.0]])
+        V = array([[c, -s, 0.0],
+                   [s, c, 0.0],
+                   [0.0, 0.0, 1.0]])
+        self.state = array([x + c * dx - s * dy,
+                            y + s * dx + c * dy,
+                            (theta + dtheta + pi) % (2*pi) - pi])
+        A = concatenate((dot(self.factor, G.T),
+                         dot(covariance_factor(motion_covariance), V.T)))
+        self.factor = linalg.qr(A, mode='r')
+
+    def correct(self, measurement, landmark):
+        """The correction step of the Kalman filter."""
+        H = self.dh_dstate(self.state, landmark, self.scanner_displacement)
+        innovation = array(measurement) - self.h(self.state, landmark, self.scanner_displacement)
+        innovation[1] = (innovation[1] + pi) % (2*pi) - pi
+        correction, self.factor = square_root_correction(
+            self.factor, H, innovation,
+            [self.measurement_distance_stddev**2,
+             self.measurement_angle_stddev**2])
+        self.state = self.state + correction
+
+    def correct_batch(self, measurements, landmarks):
+        """Same as ExtendedKalmanFilter.correct_batch, in square-root
+           form."""
+        if len(landmarks) == 0:
+            return
+        z, H = predict_measurements(self.state, landmarks,
+                                    self.scanner_displacement)
+        innovation = array(measurements, dtype=float) - z
+        innovation[:, 1] = (innovation[:, 1] + pi) % (2*pi) - pi
+        correction, self.factor = square_root_correction(
+            self.factor, H.reshape(-1, 3), innovation.ravel(),
+            tile([self.measurement_distance_stddev**2,
+                  self.measurement_angle_stddev**2], len(z)))
+        self.state = self.state + correction
+
+
+if __name__ == '__main__':
+    # Robot constants.
+    scanner_displacement = 30.0
+    ticks_to_mm = 0.349
+    robot_width = 155.0
+
+    # Cylinder extraction and matching constants.
+    minimum_valid_distance = 20.0
+    depth_jump = 100.0
+    cylinder_offset = 90.0
+    max_cylinder_distance = 300.0
+
+    # Filter constants.
+    control_motion_factor = 0.35  # Error in motor control.
+    control_turn_factor = 0.6  # Additional error due to slip when turning.
+    measurement_distance_stddev = 200.0  # Distance measurement error of cylinders.
+    measurement_angle_stddev = 15.0 / 180.0 * pi  # Angle measurement error.
+
+    # Measured start position.
+    initial_state = array([1850.0, 1897.0, 213.0 / 180.0 * pi])
+    # Covariance at start position.
+    initial_covariance = diag([100.0**2, 100.0**2, (10.0 / 180.0 * pi) ** 2])
+
+    # Read data.
+    logfile = LegoLogfile()
+    logfile.read("robot4_motors.txt")
+    logfile.read("robot4_scan.txt")
+    logfile.read("robot_arena_landmarks.txt")
+    reference_cylinders = [l[1:3] for l in logfile.landmarks]
+
+    # Run the normal and the square-root filter, with the observations
+    # of the square-root filter, so that both get the same corrections.
+    kf = ExtendedKalmanFilter(initial_state, initial_covariance,
+                              robot_width, scanner_displacement,
+                              control_motion_factor, control_turn_factor,
+                              measurement_distance_stddev,
+                              measurement_angle_stddev)
+    sf = SquareRootExtendedKalmanFilter(initial_state, initial_covariance,
+                                        robot_width, scanner_displacement,
+                                        control_motion_factor,
+                                        control_turn_factor,
+                                        measurement_distance_stddev,
+                                        measurement_angle_stddev)
+    times = {kf: 0.0, sf: 0.0}
+    max_state_difference = zeros(3)
+    max_stddev_difference = zeros(3)
+    max_asymmetry = 0.0
+    f = open("kalman_square_root.txt", "w")
+    for i in xrange(len(logfile.motor_ticks)):
+        control = array(logfile.motor_ticks[i]) * ticks_to_mm
+        observations = get_observations(
+            logfile.scan_data[i],
+            depth_jump, minimum_valid_distance, cylinder_offset,
+            sf.state, scanner_displacement,
+            reference_cylinders, max_cylinder_distance)
+        for filter in (kf, sf):
+            start = timeit.default_timer()
+            filter.predict(control)
+            for j in xrange(len(observations)):
+                filter.correct(*observations[j])
+            times[filter] += timeit.default_timer() - start
+
+        max_state_difference = maximum(max_state_difference,
+                                       abs(kf.state - sf.state))
+        max_stddev_difference = maximum(
+            max_stddev_difference,
+            abs(sqrt(diag(kf.covariance)) - sqrt(diag(sf.covariance))))
+        max_asymmetry = max(max_asymmetry,
+                            abs(kf.covariance - kf.covariance.T).max())
+
+        # Output the center of the scanner, not the center of the robot.
+        print >> f, "F %f %f %f" % \
+            tuple(sf.state + [scanner_displacement * cos(sf.state[2]),
+                              scanner_displacement * sin(sf.state[2]),
+                              0.0])
+        e = SquareRootExtendedKalmanFilter.get_error_ellipse(sf.factor)
+        print >> f, "E %f %f %f %f" % \
+            (e + (sqrt(dot(sf.factor[:, 2], sf.factor[:, 2])),))
+        write_cylinders(f, "W C", [m[1] for m in observations])
+    f.close()
+
+    n = len(logfile.motor_ticks)
+    # ExtendedKalmanFilter.predict prints V, so start a new line.
+    print
+    print "Time per step: normal %.3f ms, square root %.3f ms" % \
+        (times[kf] / n * 1000.0, times[sf] / n * 1000.0)
+    print "Max. difference of x, y, heading:", max_state_difference
+    print "Max. difference of their standard deviations:", \
+        max_stddev_difference
+    print "Max. asymmetry of the normal filter's covariance:", max_asymmetry
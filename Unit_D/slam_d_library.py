@@ -3,6 +3,12 @@
 # Claus Brenner, 11 DEC 2012
 from math import sin, cos, pi
 from lego_robot import LegoLogfile
+import numpy as np
+
+# Chi-square value for 2 degrees of freedom (range, bearing) at 99%.
+# A predicted and an actual measurement whose squared Mahalanobis distance
+# is below this value are considered compatible.
+chi2_gate_2dof = 9.21
 
 # Utility to write a list of cylinders to (one line of) a given file.
 # Line header defines the start of each line, e.g. "D C" for a detected
@@ -101,3 +107,110 @@ def get_observations(scan, jump, min_dist, cylinder_offset,
             result.append(((distance, angle), best_ref))
 
     return result
+
+# Vectorized version of the filter's h and dh_dstate, for many landmarks.
+# Takes a (x, y, theta) state and a list of m (x, y) landmarks and returns
+# an (m, 2) array of predicted (range, bearing) measurements and the
+# (m, 2, 3) array of their derivatives with respect to the state.
+def predict_measurements(state, landmarks, scanner_displacement):
+    landmarks = np.asarray(landmarks, dtype=float).reshape(-1, 2)
+    theta = state[2]
+    cost, sint = cos(theta), sin(theta)
+    dx = landmarks[:, 0] - (state[0] + scanner_displacement * cost)
+    dy = landmarks[:, 1] - (state[1] + scanner_displacement * sint)
+    q = dx * dx + dy * dy
+    sqrtq = np.sqrt(q)
+
+    z = np.empty((len(landmarks), 2))
+    z[:, 0] = sqrtq
+    z[:, 1] = (np.arctan2(dy, dx) - theta + pi) % (2 * pi) - pi
+
+    H = np.empty((len(landmarks), 2, 3))
+    H[:, 0, 0] = -dx / sqrtq
+    H[:, 0, 1] = -dy / sqrtq
+    H[:, 0, 2] = (dx * sint - dy * cost) * scanner_displacement / sqrtq
+    H[:, 1, 0] = dy / q
+    H[:, 1, 1] = -dx / q
+    H[:, 1, 2] = -1 - scanner_displacement / q * (dx * cost + dy * sint)
+    return z, H
+
+# Squared Mahalanobis distances between k measurements, given as (k, 2)
+# array of (range, bearing), and m predicted measurements z (m, 2) with
+# innovation covariances S (m, 2, 2). Returns a (k, m) array.
+def mahalanobis_distances(measurements, z, S):
+    innovation = measurements[:, np.newaxis, :] - z[np.newaxis, :, :]
+    innovation[:, :, 1] = (innovation[:, :, 1] + pi) % (2 * pi) - pi
+    # Explicit inverse of all 2x2 matrices at once.
+    a, b, c, d = S[:, 0, 0], S[:, 0, 1], S[:, 1, 0], S[:, 1, 1]
+    det = a * d - b * c
+    u, v = innovation[:, :, 0], innovation[:, :, 1]
+    return (d * u * u - (b + c) * u * v + a * v * v) / det
+
+# Like get_observations, but instead of using a fixed radius around the
+# detected cylinder, every detection is compared to every reference cylinder
+# in measurement space: all predicted measurements, their derivatives and
+# innovation covariances S = H P H^T + Q are computed in one pass, using
+# the filter's state and covariance. Each detection is assigned the
+# reference cylinder with the smallest Mahalanobis distance, if this is
+# below the chi-square gate. Detections which do not pass the gate are not
+# returned, so they do not cause a correction step.
+# robot must provide state, covariance, scanner_displacement,
+# measurement_distance_stddev and measurement_angle_stddev.
+def get_observations_gated(scan, jump, min_dist, cylinder_offset,
+                           robot, reference_cylinders,
+                           gate = chi2_gate_2dof):
+    der = compute_derivative(scan, min_dist)
+    cylinders = find_cylinders(scan, der, jump, min_dist)
+    if not cylinders or not reference_cylinders:
+        return []
+
+    # The (distance, angle) measurements of all cylinders.
+    measurements = np.array(
+        [(c[1] + cylinder_offset, LegoLogfile.beam_index_to_angle(c[0]))
+         for c in cylinders])
+
+    # Predicted measurements and innovation covariances for all references.
+    z, H = predict_measurements(robot.state, reference_cylinders,
+                                robot.scanner_displacement)
+    Q = np.diag([robot.measurement_distance_stddev ** 2,
+                 robot.measurement_angle_stddev ** 2])
+    S = np.einsum('mij,jk,mlk->mil', H, robot.covariance, H) + Q
+
+    d2 = mahalanobis_distances(measurements, z, S)
+    best = np.argmin(d2, axis=1)
+    result = []
+    for i in xrange(len(cylinders)):
+        j = best[i]
+        if d2[i, j] < gate:
+            result.append((tuple(measurements[i]), reference_cylinders[j]))
+
+    return result
+
+# Helpers for square-root Kalman filters, which keep an upper triangular
+# factor U of the covariance P = UT U instead of P.
+# Returns such a U for the given covariance. Unlike the Cholesky
+# decomposition, this also works for a covariance which is only positive
+# semidefinite (e.g. all zero).
+def covariance_factor(covariance):
+    eigenvals, eigenvects = np.linalg.eigh(covariance)
+    A = np.sqrt(np.maximum(eigenvals, 0.0))[:, np.newaxis] * eigenvects.T
+    return np.linalg.qr(A, mode='r')
+
+# The square-root correction step. factor is U of the current covariance,
+# H the (m, n) derivative of m measurements, innovation their (m) differences
+# to the predicted measurements, and variances their (m) variances (Q is
+# diagonal). Returns the state correction K innovation and the factor of the
+# corrected covariance, both from one QR decomposition of the array
+# [[sqrt(Q), 0], [U HT, U]].
+def square_root_correction(factor, H, innovation, variances):
+    m, n = H.shape
+    A = np.zeros((m + n, m + n))
+    A[:m, :m] = np.diag(np.sqrt(variances))
+    A[m:, :m] = np.dot(factor, H.T)
+    A[m:, m:] = factor
+    R = np.linalg.qr(A, mode='r')
+    # AT A = RT R, so S = R11T R11, H P = R11T R12, and the new covariance
+    # is P - R12T R12 = R22T R22. Thus, K = P HT S^-1 = R12T R11^-T.
+    # (R11 is only m x m, so a general solve is fine.)
+    correction = np.dot(R[:m, m:].T, np.linalg.solve(R[:m, :m].T, innovation))
+    return correction, R[m:, m:]
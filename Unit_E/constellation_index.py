@@ -0,0 +1,180 @@
+# Relocalization by geometric hashing of landmark constellations.
+# The distances between landmarks do not depend on the pose of the robot.
+# So, the landmark map is indexed once, by the (quantized) distances of all
+# landmark pairs and by the (quantized, sorted) side lengths of all landmark
+# triangles. The cylinders detected in a scan form pairs and triangles as
+# well, whose lengths are looked up in the index. Every hit assigns
+# detections to landmarks, from which a pose is computed. Each pose is then
+# verified by counting the detections which are close to a landmark.
+# The cost of a query depends on the number of detections and the number of
+# hits, but (for a map of evenly spaced landmarks) not on the size of the
+# map.
+from math import sin, cos, pi, atan2, sqrt
+from itertools import combinations, permutations
+import random
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Computes the rigid transform (rotation and translation) which maps the
+# (n, 2) array of points to the (n, 2) array of targets, in the least
+# squares sense. Returns (x, y, angle), i.e. the pose of the points'
+# coordinate system.
+def estimate_rigid_pose(points, targets):
+    pc = np.mean(points, axis=0)
+    tc = np.mean(targets, axis=0)
+    p = points - pc
+    t = targets - tc
+    angle = atan2(np.sum(p[:, 0] * t[:, 1] - p[:, 1] * t[:, 0]),
+                  np.sum(p[:, 0] * t[:, 0] + p[:, 1] * t[:, 1]))
+    c, s = cos(angle), sin(angle)
+    return (tc[0] - (c * pc[0] - s * pc[1]),
+            tc[1] - (s * pc[0] + c * pc[1]),
+            angle)
+
+
+class ConstellationIndex(object):
+    """Index of the pairs and triangles of the given landmarks ((x, y)
+       tuples). tolerance is the maximum error of a distance between two
+       detections (in mm). Only pairs and triangles whose sides are shorter
+       than max_distance (e.g. the range of the scanner) are indexed."""
+    def __init__(self, landmarks, tolerance = 100.0, max_distance = None,
+                 scanner_displacement = 0.0):
+        self.landmarks = np.asarray(landmarks, dtype=float).reshape(-1, 2)
+        self.tolerance = tolerance
+        self.scanner_displacement = scanner_displacement
+        self.tree = cKDTree(self.landmarks)
+        if max_distance is None:
+            max_distance = np.inf
+        n = len(self.landmarks)
+        d = np.hypot(self.landmarks[:, np.newaxis, 0] - self.landmarks[:, 0],
+                     self.landmarks[:, np.newaxis, 1] - self.landmarks[:, 1])
+        self.distances = d
+
+        # Pairs, in both directions.
+        self.pairs = {}
+        for i, j in combinations(xrange(n), 2):
+            if d[i, j] <= max_distance:
+                key = self.quantize(d[i, j])
+                self.pairs.setdefault(key, []).extend([(i, j), (j, i)])
+
+        # Triangles, keyed by their sorted side lengths.
+        self.triangles = {}
+        for i, j, k in combinations(xrange(n), 3):
+            sides = (d[i, j], d[j, k], d[i, k])
+            if max(sides) <= max_distance:
+                key = tuple(sorted(self.quantize(s) for s in sides))
+                self.triangles.setdefault(key, []).append((i, j, k))
+
+    def quantize(self, distance):
+        return int(distance / self.tolerance)
+
+    def lookup_pairs(self, distance):
+        """Returns all landmark pairs (i, j) whose distance may be equal to
+           distance, within the tolerance."""
+        key = self.quantize(distance)
+        result = []
+        for k in (key - 1, key, key + 1):
+            result.extend(self.pairs.get(k, []))
+        return result
+
+    def lookup_triangles(self, sides):
+        """Returns all landmark triangles (i, j, k) whose sorted side
+           lengths may be equal to the sorted sides, within the
+           tolerance."""
+        keys = sorted(self.quantize(s) for s in sides)
+        result = []
+        for a in (-1, 0, 1):
+            for b in (-1, 0, 1):
+                for c in (-1, 0, 1):
+                    result.extend(self.triangles.get(
+                        (keys[0] + a, keys[1] + b, keys[2] + c), []))
+        return result
+
+    def verify(self, scanner_pose, detections):
+        """Transforms the detections using scanner_pose and returns the
+           number of detections closer than tolerance to a landmark, and
+           their RMS distance."""
+        x, y, angle = scanner_pose
+        c, s = cos(angle), sin(angle)
+        world = np.column_stack(
+            (c * detections[:, 0] - s * detections[:, 1] + x,
+             s * detections[:, 0] + c * detections[:, 1] + y))
+        distances, indices = self.tree.query(
+            world, distance_upper_bound=self.tolerance)
+        inliers = np.isfinite(distances)
+        count = np.count_nonzero(inliers)
+        rms = sqrt(np.mean(distances[inliers] ** 2)) if count else np.inf
+        return count, rms
+
+    def hypotheses(self, detections):
+        """Yields (detection indices, landmark indices) assignments, from
+           all triangles of detections, or all pairs if there are less than
+           three detections."""
+        n = len(detections)
+        dd = np.hypot(detections[:, np.newaxis, 0] - detections[:, 0],
+                      detections[:, np.newaxis, 1] - detections[:, 1])
+        if n >= 3:
+            for triple in combinations(xrange(n), 3):
+                sides = [dd[a, b] for a, b in combinations(triple, 2)]
+                for landmarks in self.lookup_triangles(sides):
+                    # The sorted sides match, now find the assignments of
+                    # the vertices for which all sides match.
+                    for perm in permutations(landmarks):
+                        if all(abs(dd[triple[a], triple[b]] -
+                                   self.distances[perm[a], perm[b]]) <=
+                               self.tolerance
+                               for a, b in ((0, 1), (1, 2), (0, 2))):
+                            yield triple, perm
+        elif n == 2:
+            for pair in self.lookup_pairs(dd[0, 1]):
+                if abs(dd[0, 1] - self.distances[pair]) <= self.tolerance:
+                    yield (0, 1), pair
+
+    def match(self, detections, max_candidates = 10):
+        """Matches the detected cylinders ((x, y) in the scanner's coordinate
+           system) to the landmarks. Returns a list of up to max_candidates
+           tuples (robot_pose, score, rms), best first, where score is the
+           number of detections which are close to a landmark if the robot
+           is at robot_pose, and rms is their RMS distance."""
+        detections = np.asarray(detections, dtype=float).reshape(-1, 2)
+        candidates = []
+        for detection_indices, landmark_indices in \
+                self.hypotheses(detections):
+            pose = estimate_rigid_pose(
+                detections[list(detection_indices)],
+                self.landmarks[list(landmark_indices)])
+            # Skip poses which were found already (from another triangle).
+            if any(abs(pose[0] - p[0]) < self.tolerance and
+                   abs(pose[1] - p[1]) < self.tolerance and
+                   abs((pose[2] - p[2] + pi) % (2 * pi) - pi) < 0.1
+                   for p, score, rms in candidates):
+                continue
+            score, rms = self.verify(pose, detections)
+            candidates.append((pose, score, rms))
+
+        candidates.sort(key=lambda c: (-c[1], c[2]))
+        # Convert the scanner poses to robot poses.
+        d = self.scanner_displacement
+        return [((x - d * cos(a), y - d * sin(a), a), score, rms)
+                for (x, y, a), score, rms in candidates[:max_candidates]]
+
+
+# Generates particles for (re-)initializing a particle filter, around the
+# best candidates returned by ConstellationIndex.match, i.e. all candidates
+# with the highest score. standard_deviations are those of
+# (x, y, heading). Returns a list of (x, y, heading) tuples, or an empty
+# list if there are no candidates.
+def relocalization_particles(candidates, number_of_particles,
+                             standard_deviations = (50.0, 50.0, 0.1)):
+    if not candidates:
+        return []
+    best = [pose for pose, score, rms in candidates
+            if score == candidates[0][1]]
+    particles = []
+    for i in xrange(number_of_particles):
+        pose = best[i % len(best)]
+        particles.append(tuple(
+            random.gauss(pose[j], standard_deviations[j])
+            for j in xrange(3)))
+    return particles
@@ -0,0 +1,204 @@
+# Grid (histogram) localization: a Bayes filter over (x, y, heading) cells,
+# the 3D version of the histogram filter of Unit C.
+# The belief is a (headings, x, y) array of probabilities.
+# In the prediction, the robot moves by a different (x, y) displacement in
+# each heading layer, so every layer is shifted by its own displacement and
+# blurred by the motion noise. Both are done at once, with a separable
+# kernel (a sampled gaussian, centered at the sub-cell displacement) per
+# layer. Then, all layers are shifted (circularly) by the rotation, again
+# with a gaussian kernel. The kernels are only a few cells wide, so direct
+# convolution (a sum of shifted arrays) is faster than the FFT here.
+# In the correction, the likelihood of the detected cylinders is computed
+# for all cells at once, in the same way as the particle filter computes it
+# for one particle: each cylinder is assigned to the closest landmark, and
+# the differences in range and bearing are weighted by gaussians. Once the
+# robot is localized, most cells have a negligible probability, so the
+# likelihood is only computed for the others.
+from math import ceil, pi, sqrt
+import numpy as np
+
+
+# Returns the (n, 2 * radius + 1) array of kernels, which shift by shift[i]
+# cells and blur by sigma[i] cells. Kernel j holds the weights of offsets
+# -radius ... radius. sigma is at least half a cell, so that sub-cell shifts
+# move (some of) the mass.
+def shift_kernels(shift, sigma, radius):
+    offsets = np.arange(-radius, radius + 1)
+    sigma = np.maximum(sigma, 0.5)
+    kernels = np.exp(-0.5 * ((offsets - shift[:, np.newaxis]) /
+                             sigma[:, np.newaxis]) ** 2)
+    return kernels / np.sum(kernels, axis=1)[:, np.newaxis]
+
+
+# Returns array convolved along axis 1 or 2, where layer k (along axis 0)
+# uses kernels[k]. Mass which is moved outside the array is lost.
+def convolve_layers(array, kernels, axis):
+    radius = (kernels.shape[1] - 1) // 2
+    n = array.shape[axis]
+    result = np.zeros(array.shape)
+    for j in xrange(-radius, radius + 1):
+        if abs(j) >= n:
+            continue
+        w = kernels[:, j + radius][:, np.newaxis, np.newaxis]
+        src = [slice(None)] * 3
+        dst = [slice(None)] * 3
+        src[axis] = slice(max(-j, 0), n - max(j, 0))
+        dst[axis] = slice(max(j, 0), n - max(-j, 0))
+        result[tuple(dst)] += w * array[tuple(src)]
+    return result
+
+
+class GridFilter(object):
+    """Histogram filter over the (x, y, heading) cells of the rectangle
+       lower to upper, with cells of cell_size (mm) and heading_step
+       (radians). The constants are the same as for the particle filter."""
+    def __init__(self, robot_width, scanner_displacement,
+                 control_motion_factor, control_turn_factor,
+                 measurement_distance_stddev, measurement_angle_stddev,
+                 lower = (0.0, 0.0), upper = (2000.0, 2000.0),
+                 cell_size = 50.0, heading_step = 5.0 / 180.0 * pi,
+                 min_relative_probability = 1e-12):
+        self.robot_width = robot_width
+        self.scanner_displacement = scanner_displacement
+        self.control_motion_factor = control_motion_factor
+        self.control_turn_factor = control_turn_factor
+        self.measurement_distance_stddev = measurement_distance_stddev
+        self.measurement_angle_stddev = measurement_angle_stddev
+        self.min_relative_probability = min_relative_probability
+
+        # Cell centers.
+        self.cell_size = float(cell_size)
+        nx, ny = [int(ceil((u - l) / self.cell_size))
+                  for l, u in zip(lower, upper)]
+        self.x = lower[0] + (np.arange(nx) + 0.5) * self.cell_size
+        self.y = lower[1] + (np.arange(ny) + 0.5) * self.cell_size
+        nh = int(round(2 * pi / heading_step))
+        self.heading_step = 2 * pi / nh
+        self.headings = np.arange(nh) * self.heading_step
+        self.shape = (nh, nx, ny)
+        self.set_uniform()
+
+    def set_uniform(self):
+        """Sets the belief to the uniform distribution (unknown pose)."""
+        self.belief = np.ones(self.shape) / np.prod(self.shape)
+
+    def set_gaussian(self, state, standard_deviations):
+        """Sets the belief to a gaussian around the state (x, y, heading),
+           with the given standard deviations of x, y, heading."""
+        sx, sy, sh = standard_deviations
+        dh = (self.headings - state[2] + pi) % (2 * pi) - pi
+        b = np.exp(-0.5 * (dh / sh) ** 2)[:, np.newaxis, np.newaxis] * \
+            np.exp(-0.5 * ((self.x - state[0]) / sx) ** 2)[:, np.newaxis] * \
+            np.exp(-0.5 * ((self.y - state[1]) / sy) ** 2)
+        self.belief = b / np.sum(b)
+
+    def predict(self, control):
+        """The prediction step: moves the belief by the control (left,
+           right), as the particle filter's g, and blurs it by the motion
+           noise."""
+        left, right = control
+        w = self.robot_width
+        theta = self.headings
+        # Displacement of the robot center, for all heading layers.
+        if right != left:
+            alpha = (right - left) / w
+            rad = left / alpha
+            dx = (rad + w / 2.) * (np.sin(theta + alpha) - np.sin(theta))
+            dy = (rad + w / 2.) * (-np.cos(theta + alpha) + np.cos(theta))
+        else:
+            alpha = 0.0
+            dx = left * np.cos(theta)
+            dy = left * np.sin(theta)
+
+        # Noise of the left and right track, as in the particle filter,
+        # converted to the noise of the center and the heading.
+        sigmal2 = (self.control_motion_factor * left) ** 2 + \
+                  (self.control_turn_factor * (left - right)) ** 2
+        sigmar2 = (self.control_motion_factor * right) ** 2 + \
+                  (self.control_turn_factor * (left - right)) ** 2
+        sigma_xy = sqrt(sigmal2 + sigmar2) / 2.0 / self.cell_size
+        sigma_h = sqrt(sigmal2 + sigmar2) / w / self.heading_step
+
+        # Translation, separately in x and y.
+        b = self.belief
+        for axis, d in ((1, dx), (2, dy)):
+            shift = d / self.cell_size
+            sigma = np.ones(len(shift)) * sigma_xy
+            radius = int(ceil(np.max(np.abs(shift)) + 3 * max(sigma_xy, 0.5)))
+            b = convolve_layers(b, shift_kernels(shift, sigma, radius), axis)
+
+        # Rotation, the same for all layers, and circular.
+        shift = alpha / self.heading_step
+        radius = int(ceil(abs(shift) + 3 * max(sigma_h, 0.5)))
+        kernel = shift_kernels(np.array([shift]), np.array([sigma_h]),
+                               radius)[0]
+        result = np.zeros(self.shape)
+        for j in xrange(-radius, radius + 1):
+            result += kernel[j + radius] * np.roll(b, j, axis=0)
+
+        s = np.sum(result)
+        if s > 0.0:
+            self.belief = result / s
+
+    def log_likelihood(self, cylinders, landmarks, cells = None):
+        """Returns the log likelihood (up to a constant) of the cylinders
+           ((range, bearing, x, y) tuples, as from get_cylinders_from_scan)
+           given the landmarks ((x, y) tuples), for the cells with the given
+           flat indices (default: all cells), as a 1D array."""
+        landmarks = np.asarray(landmarks, dtype=float).reshape(-1, 2)
+        if cells is None:
+            cells = np.arange(np.prod(self.shape))
+        k, i, j = np.unravel_index(cells, self.shape)
+        theta = self.headings[k]
+        # Scanner positions.
+        sx = self.x[i] + self.scanner_displacement * np.cos(theta)
+        sy = self.y[j] + self.scanner_displacement * np.sin(theta)
+        result = np.zeros(len(cells))
+        for r, bearing, cx, cy in cylinders:
+            # World position of the cylinder, and the closest landmark.
+            wx = sx + r * np.cos(theta + bearing)
+            wy = sy + r * np.sin(theta + bearing)
+            closest = np.argmin((wx[:, np.newaxis] - landmarks[:, 0]) ** 2 +
+                                (wy[:, np.newaxis] - landmarks[:, 1]) ** 2,
+                                axis=1)
+            # Difference to the expected range and bearing. (sqrt is much
+            # faster than np.hypot, and rint faster than %.)
+            ex = landmarks[closest, 0] - sx
+            ey = landmarks[closest, 1] - sy
+            dr = r - np.sqrt(ex * ex + ey * ey)
+            da = bearing - np.arctan2(ey, ex) + theta
+            da -= (2 * pi) * np.rint(da / (2 * pi))
+            result -= 0.5 * ((dr / self.measurement_distance_stddev) ** 2 +
+                             (da / self.measurement_angle_stddev) ** 2)
+        return result
+
+    def correct(self, cylinders, landmarks):
+        """The correction step: multiplies the belief by the likelihood of
+           the cylinders. The likelihood is only computed for the cells
+           whose probability is larger than min_relative_probability times
+           the maximum probability. All other cells are set to zero."""
+        if not cylinders:
+            return
+        belief = self.belief.ravel()
+        cells = np.flatnonzero(
+            belief > self.min_relative_probability * np.max(belief))
+        log_likelihood = self.log_likelihood(cylinders, landmarks, cells)
+        log_posterior = np.log(belief[cells]) + log_likelihood
+        posterior = np.zeros(len(belief))
+        posterior[cells] = np.exp(log_posterior - np.max(log_posterior))
+        self.belief = (posterior / np.sum(posterior)).reshape(self.shape)
+
+    def get_mean(self):
+        """Returns the mean (x, y, heading) of the belief. The heading is the
+           mean of the heading vectors."""
+        p_h = np.sum(self.belief, axis=(1, 2))
+        p_x = np.sum(self.belief, axis=(0, 2))
+        p_y = np.sum(self.belief, axis=(0, 1))
+        return (np.dot(p_x, self.x), np.dot(p_y, self.y),
+                np.arctan2(np.dot(p_h, np.sin(self.headings)),
+                           np.dot(p_h, np.cos(self.headings))))
+
+    def get_max(self):
+        """Returns the (x, y, heading) of the most probable cell."""
+        k, i, j = np.unravel_index(np.argmax(self.belief), self.shape)
+        return (self.x[i], self.y[j], (self.headings[k] + pi) % (2 * pi) - pi)
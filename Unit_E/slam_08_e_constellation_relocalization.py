@@ -0,0 +1,101 @@
+# The particle filter of slam_08_c, without a known start position.
+# Instead of spreading a large number of particles uniformly in the arena
+# (as in slam_08_d), the detected cylinders are matched against the
+# constellation index of the landmarks, and a few particles are placed
+# around the best candidate poses. The same is done whenever the filter
+# has lost track, i.e. if most of the detected cylinders do not fit the
+# landmarks for several steps in a row.
+#
+# slam_08_e_constellation_relocalization
+from lego_robot import *
+from slam_e_library import get_cylinders_from_scan
+from math import sin, cos, pi
+import numpy as np
+from slam_08_c_density_estimation_question import ParticleFilter
+from constellation_index import ConstellationIndex, relocalization_particles
+
+
+if __name__ == '__main__':
+    # Robot constants.
+    scanner_displacement = 30.0
+    ticks_to_mm = 0.349
+    robot_width = 155.0
+
+    # Cylinder extraction and matching constants.
+    minimum_valid_distance = 20.0
+    depth_jump = 100.0
+    cylinder_offset = 90.0
+
+    # Filter constants.
+    control_motion_factor = 0.35  # Error in motor control.
+    control_turn_factor = 0.6  # Additional error due to slip when turning.
+    measurement_distance_stddev = 200.0  # Distance measurement error of cylinders.
+    measurement_angle_stddev = 15.0 / 180.0 * pi  # Angle measurement error.
+
+    # Relocalization constants.
+    number_of_particles = 50
+    standard_deviations = (50.0, 50.0, 5.0 / 180.0 * pi)
+    constellation_tolerance = 100.0  # Error of the distance of 2 cylinders.
+    min_score = 3  # Cylinders which must fit for a (re-)initialization.
+    max_lost_steps = 5  # Steps with a bad fit, until relocalization.
+
+    # Read data.
+    logfile = LegoLogfile()
+    logfile.read("robot4_motors.txt")
+    logfile.read("robot4_scan.txt")
+    logfile.read("robot_arena_landmarks.txt")
+    reference_cylinders = [l[1:3] for l in logfile.landmarks]
+
+    # Setup index and filter, which has no particles yet.
+    index = ConstellationIndex(reference_cylinders, constellation_tolerance,
+                               scanner_displacement = scanner_displacement)
+    pf = ParticleFilter([],
+                        robot_width, scanner_displacement,
+                        control_motion_factor, control_turn_factor,
+                        measurement_distance_stddev,
+                        measurement_angle_stddev)
+
+    f = open("particle_filter_relocalization.txt", "w")
+    lost_steps = 0
+    relocalizations = 0
+    for i in xrange(len(logfile.motor_ticks)):
+        cylinders = get_cylinders_from_scan(logfile.scan_data[i], depth_jump,
+                                            minimum_valid_distance, cylinder_offset)
+        detections = [c[2:4] for c in cylinders]
+
+        if pf.particles:
+            # Prediction and correction, as in slam_08_c.
+            control = map(lambda x: x * ticks_to_mm, logfile.motor_ticks[i])
+            pf.predict(control)
+            pf.correct(cylinders, reference_cylinders)
+
+            # Check if the cylinders still fit, at the mean pose.
+            mean = pf.get_mean()
+            if len(detections) >= min_score:
+                score, rms = index.verify(
+                    (mean[0] + scanner_displacement * cos(mean[2]),
+                     mean[1] + scanner_displacement * sin(mean[2]),
+                     mean[2]), np.array(detections))
+                lost_steps = lost_steps + 1 if 2 * score < len(detections) else 0
+
+        if not pf.particles or lost_steps >= max_lost_steps:
+            candidates = index.match(detections)
+            if candidates and candidates[0][1] >= min_score:
+                pf.particles = relocalization_particles(
+                    candidates, number_of_particles, standard_deviations)
+                lost_steps = 0
+                relocalizations += 1
+
+        if pf.particles:
+            # Output particles.
+            pf.print_particles(f)
+
+            # Output state estimated from all particles.
+            mean = pf.get_mean()
+            print >> f, "F %.0f %.0f %.3f" % \
+                        (mean[0] + scanner_displacement * cos(mean[2]),
+                         mean[1] + scanner_displacement * sin(mean[2]),
+                         mean[2])
+
+    f.close()
+    print "Relocalizations:", relocalizations
@@ -0,0 +1,115 @@
+# Benchmark of the grid (histogram) filter, compared to the particle filter
+# of slam_08_c, on the robot4 log: the time per step (prediction and
+# correction), and the distance of the estimated scanner position to the
+# reference position.
+# The grid filter is run from the same start as the particle filter, and
+# also from a uniform belief, i.e. without knowing the start position.
+# The grid filter's result is written to grid_filter.txt.
+#
+# slam_08_f_grid_filter_benchmark
+from lego_robot import *
+from slam_e_library import get_cylinders_from_scan
+from math import sin, cos, pi
+import random
+import timeit
+import numpy as np
+from slam_08_c_density_estimation_question import ParticleFilter
+from grid_localization import GridFilter
+
+
+# Runs the filter (which has predict, correct and get_mean) on the log.
+# Returns the times per step (in ms) and the list of estimated scanner
+# poses.
+def run_filter(filter, logfile, cylinders, landmarks, ticks_to_mm,
+               scanner_displacement):
+    times = []
+    poses = []
+    for i in xrange(len(logfile.motor_ticks)):
+        control = map(lambda x: x * ticks_to_mm, logfile.motor_ticks[i])
+        start = timeit.default_timer()
+        filter.predict(control)
+        filter.correct(cylinders[i], landmarks)
+        times.append((timeit.default_timer() - start) * 1000.0)
+        mean = filter.get_mean()
+        poses.append((mean[0] + scanner_displacement * cos(mean[2]),
+                      mean[1] + scanner_displacement * sin(mean[2]),
+                      mean[2]))
+    return np.array(times), poses
+
+
+if __name__ == '__main__':
+    # Robot constants.
+    scanner_displacement = 30.0
+    ticks_to_mm = 0.349
+    robot_width = 155.0
+
+    # Cylinder extraction and matching constants.
+    minimum_valid_distance = 20.0
+    depth_jump = 100.0
+    cylinder_offset = 90.0
+
+    # Filter constants.
+    control_motion_factor = 0.35  # Error in motor control.
+    control_turn_factor = 0.6  # Additional error due to slip when turning.
+    measurement_distance_stddev = 200.0  # Distance measurement error of cylinders.
+    measurement_angle_stddev = 15.0 / 180.0 * pi  # Angle measurement error.
+    constants = (robot_width, scanner_displacement,
+                 control_motion_factor, control_turn_factor,
+                 measurement_distance_stddev, measurement_angle_stddev)
+
+    # Start state.
+    measured_state = (1850.0, 1897.0, 213.0 / 180.0 * pi)
+    standard_deviations = (100.0, 100.0, 10.0 / 180.0 * pi)
+
+    # Grid constants.
+    cell_size = 50.0
+    heading_step = 5.0 / 180.0 * pi
+
+    # Read data. The cylinders are extracted once, for all filters.
+    logfile = LegoLogfile()
+    logfile.read("robot4_motors.txt")
+    logfile.read("robot4_scan.txt")
+    logfile.read("robot4_reference.txt")
+    logfile.read("robot_arena_landmarks.txt")
+    reference_cylinders = [l[1:3] for l in logfile.landmarks]
+    cylinders = [get_cylinders_from_scan(scan, depth_jump,
+                                         minimum_valid_distance,
+                                         cylinder_offset)
+                 for scan in logfile.scan_data]
+    reference = np.array(logfile.reference_positions, dtype=float)
+
+    filters = []
+    grid = GridFilter(*constants, cell_size = cell_size,
+                      heading_step = heading_step)
+    grid.set_gaussian(measured_state, standard_deviations)
+    filters.append(("Grid filter", grid))
+    grid_uniform = GridFilter(*constants, cell_size = cell_size,
+                              heading_step = heading_step)
+    filters.append(("Grid filter, uniform start", grid_uniform))
+    random.seed(0)
+    for number_of_particles in (50, 200):
+        particles = [tuple(random.gauss(measured_state[j],
+                                        standard_deviations[j])
+                           for j in xrange(3))
+                     for i in xrange(number_of_particles)]
+        filters.append(("Particle filter, %d particles" % number_of_particles,
+                        ParticleFilter(particles, *constants)))
+
+    print "Grid: %d x %d x %d cells (%.0f mm, %.1f deg)" % \
+        (grid.shape[1], grid.shape[2], grid.shape[0], cell_size,
+         heading_step * 180.0 / pi)
+    print "%-32s %10s %10s %10s %10s" % \
+        ("", "mean ms", "max ms", "mean err", "max err")
+    for name, filter in filters:
+        times, poses = run_filter(filter, logfile, cylinders,
+                                  reference_cylinders, ticks_to_mm,
+                                  scanner_displacement)
+        errors = np.hypot(*(np.array(poses)[:, 0:2] - reference).T)
+        print "%-32s %10.1f %10.1f %10.0f %10.0f" % \
+            (name, np.mean(times), np.max(times), np.mean(errors),
+             np.max(errors))
+        if filter is grid:
+            f = open("grid_filter.txt", "w")
+            for pose in poses:
+                print >> f, "F %.0f %.0f %.3f" % pose
+            f.close()
@@ -5,15 +5,17 @@
 from lego_robot import *
 from math import sin, cos, pi, atan2, sqrt
 from numpy import *
-from slam_f_library import get_observations, write_cylinders, \
-    write_error_ellipses
+from slam_f_library import get_observations, get_observations_gated, \
+    get_observations_jcbb, write_cylinders, write_error_ellipses, \
+    LandmarkIndex, chi2_gate_2dof
 
 
 class ExtendedKalmanFilterSLAM:
     def __init__(self, state, covariance,
                  robot_width, scanner_displacement,
                  control_motion_factor, control_turn_factor,
-                 measurement_distance_stddev, measurement_angle_stddev):
+                 measurement_distance_stddev, measurement_angle_stddev,
+                 landmark_cell_size = None):
         # The state. This is the core data of the Kalman filter.
         self.state = state
         self.covariance = covariance
@@ -29,6 +31,14 @@ class ExtendedKalmanFilterSLAM:
         # Currently, the number of landmarks is zero.
         self.number_of_landmarks = 0
 
+        # Optional spatial index over the landmark estimates, which is used
+        # by get_observations to find the closest landmark. A good cell size
+        # is the maximum cylinder assignment distance.
+        if landmark_cell_size:
+            self.landmark_index = LandmarkIndex(landmark_cell_size)
+        else:
+            self.landmark_index = None
+
     @staticmethod
     def g(state, control, w):
         x, y, theta = state[0:3]
@@ -155,6 +165,8 @@ class ExtendedKalmanFilterSLAM:
         covariance_dr = array([[1e10, 0], [0, 1e10]])
         self.covariance = concatenate((concatenate((self.covariance, covariance_ur), axis=1),
                                        concatenate((covariance_dl, covariance_dr), axis=1)), axis=0)
+        if self.landmark_index is not None:
+            self.landmark_index.insert(self.number_of_landmarks, x, y)
         self.number_of_landmarks += 1
         return self.number_of_landmarks - 1
 
@@ -209,6 +221,9 @@ class ExtendedKalmanFilterSLAM:
         self.state = self.state + dot(K, innovation)
         self.covariance = dot(eye(size(self.state)) - dot(K, H),
                               self.covariance)
+        # The correction moves all landmarks, so update their grid cells.
+        if self.landmark_index is not None:
+            self.landmark_index.refresh(self.state)
 
     def get_landmarks(self):
         """Returns a list of (x, y) tuples of all landmark positions."""
@@ -247,6 +262,14 @@ if __name__ == '__main__':
     depth_jump = 100.0
     cylinder_offset = 90.0
     max_cylinder_distance = 500.0
+    # Data association method:
+    # 'nearest' assigns the closest landmark within max_cylinder_distance,
+    # 'mahalanobis' assigns the landmark with the smallest Mahalanobis
+    # distance in measurement space, gated by mahalanobis_gate,
+    # 'jcbb' assigns all cylinders of a scan jointly (joint compatibility
+    # branch and bound).
+    association = 'nearest'
+    mahalanobis_gate = chi2_gate_2dof
 
     # Filter constants.
     control_motion_factor = 0.35  # Error in motor control.
@@ -265,7 +288,8 @@ if __name__ == '__main__':
                                   robot_width, scanner_displacement,
                                   control_motion_factor, control_turn_factor,
                                   measurement_distance_stddev,
-                                  measurement_angle_stddev)
+                                  measurement_angle_stddev,
+                                  landmark_cell_size = max_cylinder_distance)
 
     # Read data.
     logfile = LegoLogfile()
@@ -282,10 +306,21 @@ if __name__ == '__main__':
         kf.predict(control)
 
         # Correction.
-        observations = get_observations(
-            logfile.scan_data[i],
-            depth_jump, minimum_valid_distance, cylinder_offset,
-            kf, max_cylinder_distance)
+        if association == 'jcbb':
+            observations = get_observations_jcbb(
+                logfile.scan_data[i],
+                depth_jump, minimum_valid_distance, cylinder_offset,
+                kf)
+        elif association == 'mahalanobis':
+            observations = get_observations_gated(
+                logfile.scan_data[i],
+                depth_jump, minimum_valid_distance, cylinder_offset,
+                kf, mahalanobis_gate)
+        else:
+            observations = get_observations(
+                logfile.scan_data[i],
+                depth_jump, minimum_valid_distance, cylinder_offset,
+                kf, max_cylinder_distance)
         for obs in observations:
             measurement, cylinder_world, cylinder_scanner, cylinder_index = obs
             if cylinder_index == -1:
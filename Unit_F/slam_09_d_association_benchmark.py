@@ -0,0 +1,141 @@
+# Benchmark of the data association methods for EKF SLAM, as a function
+# of the number of detections per scan and the number of landmarks in the
+# state: nearest neighbour (the loop in get_observations), nearest
+# neighbour using the LandmarkIndex, Mahalanobis gating and JCBB.
+# The filter state and the detections are synthetic: landmarks are placed
+# on a jittered grid (a dense pole field), and the detections are noisy
+# measurements of the landmarks closest to the robot.
+#
+# slam_09_d_association_benchmark
+from math import sin, cos, pi, sqrt
+from numpy import *
+import timeit
+from lego_robot import LegoLogfile
+from slam_09_c_slam_correction_question import ExtendedKalmanFilterSLAM
+from slam_f_library import LandmarkIndex, predict_landmark_measurements,\
+    mahalanobis_distances, associate_jcbb, chi2_gate_2dof
+
+
+# Sets up a filter with number_of_landmarks landmarks, spaced
+# landmark_spacing apart, and the robot in the middle of them.
+def make_filter(number_of_landmarks, landmark_spacing, cell_size):
+    kf = ExtendedKalmanFilterSLAM(
+        array([0.0, 0.0, 0.0]), diag([30.0**2, 30.0**2, (2.0/180.0*pi)**2]),
+        155.0, 30.0, 0.35, 0.6, 20.0, 1.0 / 180.0 * pi,
+        landmark_cell_size = cell_size)
+    side = int(ceil(sqrt(number_of_landmarks)))
+    for n in xrange(number_of_landmarks):
+        x = (n % side - side / 2.0) * landmark_spacing
+        y = (n / side - side / 2.0) * landmark_spacing
+        x += random.uniform(-0.2, 0.2) * landmark_spacing
+        y += random.uniform(-0.2, 0.2) * landmark_spacing
+        kf.add_landmark_to_state((x, y))
+    # Landmarks are known to within a few cm, with a common error.
+    m = kf.number_of_landmarks
+    kf.covariance[3:, 3:] = eye(2 * m) * 20.0**2 + 10.0**2
+    kf.landmark_index.refresh(kf.state)
+    return kf
+
+# Measures the number_of_detections landmarks closest to the robot.
+# Returns the (k, 2) array of (range, bearing) measurements and the
+# indices of the true landmarks.
+def make_measurements(kf, true_pose, number_of_detections):
+    m = kf.number_of_landmarks
+    landmarks = kf.state[3:3 + 2 * m].reshape(m, 2)
+    order = argsort(hypot(landmarks[:, 0] - true_pose[0],
+                          landmarks[:, 1] - true_pose[1]))
+    truth = order[:number_of_detections]
+    measurements = array([kf.h(true_pose, landmarks[j],
+                               kf.scanner_displacement) for j in truth])
+    measurements[:, 0] += random.normal(0.0, kf.measurement_distance_stddev,
+                                        len(truth))
+    measurements[:, 1] += random.normal(0.0, kf.measurement_angle_stddev,
+                                        len(truth))
+    return measurements, truth
+
+# World coordinates of the measurements, as computed in get_observations.
+def measurements_to_world(kf, measurements):
+    scanner_pose = (
+        kf.state[0] + cos(kf.state[2]) * kf.scanner_displacement,
+        kf.state[1] + sin(kf.state[2]) * kf.scanner_displacement,
+        kf.state[2])
+    return [LegoLogfile.scanner_to_world(
+                scanner_pose, (d * cos(a), d * sin(a)))
+            for d, a in measurements]
+
+def associate_nearest(kf, world, max_cylinder_distance):
+    result = []
+    for x, y in world:
+        best_dist_2 = max_cylinder_distance * max_cylinder_distance
+        best_index = -1
+        for index in xrange(kf.number_of_landmarks):
+            pole_x, pole_y = kf.state[3+2*index : 3+2*index+2]
+            dx, dy = pole_x - x, pole_y - y
+            dist_2 = dx * dx + dy * dy
+            if dist_2 < best_dist_2:
+                best_dist_2 = dist_2
+                best_index = index
+        result.append(best_index)
+    return result
+
+def associate_nearest_indexed(kf, world, max_cylinder_distance):
+    return [kf.landmark_index.nearest(kf.state, x, y, max_cylinder_distance)
+            for x, y in world]
+
+def associate_mahalanobis(kf, measurements):
+    z, J, S = predict_landmark_measurements(kf)
+    d2 = mahalanobis_distances(measurements, z, S)
+    best = argmin(d2, axis=1)
+    return [int(j) if d2[i, j] < chi2_gate_2dof else -1
+            for i, j in enumerate(best)]
+
+def associate_joint(kf, measurements):
+    return associate_jcbb(kf, measurements)[0]
+
+# Returns the mean time per call, in ms. f is called once before the
+# timing, so that one-time costs (e.g. the import of scipy.stats in
+# associate_jcbb) are not included.
+def time_call(f, repetitions):
+    f()
+    start = timeit.default_timer()
+    for _ in xrange(repetitions):
+        result = f()
+    return (timeit.default_timer() - start) / repetitions * 1000.0, result
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    landmark_spacing = 300.0
+    max_cylinder_distance = 150.0
+    repetitions = 5
+
+    print "%9s %10s | %12s %12s %12s %12s | %s" % (
+        "landmarks", "detections", "nearest", "indexed", "mahalanobis",
+        "jcbb", "correct (nn / maha / jcbb)")
+    for number_of_landmarks in (25, 100, 400):
+        for number_of_detections in (2, 5, 10, 20):
+            if number_of_detections > number_of_landmarks:
+                continue
+            kf = make_filter(number_of_landmarks, landmark_spacing,
+                             max_cylinder_distance)
+            true_pose = kf.state[0:3] + random.multivariate_normal(
+                zeros(3), kf.covariance[0:3, 0:3])
+            measurements, truth = make_measurements(
+                kf, true_pose, number_of_detections)
+            world = measurements_to_world(kf, measurements)
+
+            t_nn, nn = time_call(lambda: associate_nearest(
+                kf, world, max_cylinder_distance), repetitions)
+            t_idx, idx = time_call(lambda: associate_nearest_indexed(
+                kf, world, max_cylinder_distance), repetitions)
+            t_maha, maha = time_call(lambda: associate_mahalanobis(
+                kf, measurements), repetitions)
+            t_jcbb, jcbb = time_call(lambda: associate_joint(
+                kf, measurements), repetitions)
+            assert nn == idx
+
+            print "%9d %10d | %9.3f ms %9.3f ms %9.3f ms %9.3f ms | %d / %d / %d" % (
+                number_of_landmarks, number_of_detections,
+                t_nn, t_idx, t_maha, t_jcbb,
+                sum(array(nn) == truth), sum(array(maha) == truth),
+                sum(array(jcbb) == truth))
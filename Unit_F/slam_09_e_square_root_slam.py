@@ -0,0 +1,232 @@
+# EKF SLAM (slam_09_c) in square-root form: instead of the covariance P,
+# the filter keeps an upper triangular factor U with P = UT U, as the
+# square-root filter of Unit D, so the covariance is symmetric and positive
+# semidefinite by construction, without any re-symmetrization.
+# U is the factor of the state in reverse order, i.e. the robot's columns
+# are the last ones. This makes the prediction cheap:
+# - G is the identity except for the robot's 3x3 block, so U GT only
+#   changes the last three columns of U. In these, only the last three rows
+#   are below the diagonal, and the control noise adds two more rows. So
+#   only this 5 x 3 block is triangularized, and the prediction takes O(n)
+#   instead of the O(n^3) of a full QR decomposition.
+# - A new landmark adds a diagonal block of sqrt(1e10) in front of U.
+# - The correction processes the distance and the bearing one after the
+#   other, each by a rank one update of U in O(n^2) (see
+#   square_root_update), instead of a QR decomposition in O(n^3).
+# The main program runs the square-root filter and the normal filter on
+# the same data and compares them. Note that with the few landmarks of this
+# log, the time is mostly the overhead of the numpy calls, and there are
+# more of them in the square-root filter, so it is still slower. It gets
+# cheaper than the normal filter as the map grows (at 100 landmarks, the
+# prediction takes about 0.07 instead of 3 ms, the correction about 0.9
+# instead of 1.6 ms).
+#
+# slam_09_e_square_root_slam
+from lego_robot import *
+from math import sin, cos, pi, atan2, sqrt
+from numpy import *
+import timeit
+from slam_f_library import get_observations, write_cylinders, \
+    write_error_ellipses, covariance_factor, square_root_update
+from slam_09_c_slam_correction_question import ExtendedKalmanFilterSLAM
+
+
+class SquareRootExtendedKalmanFilterSLAM(ExtendedKalmanFilterSLAM, object):
+    """ExtendedKalmanFilterSLAM which keeps an upper triangular factor U of
+       the covariance, for the state in reverse order (landmarks first, the
+       robot's x, y, heading last): P[::-1, ::-1] = UT U. The covariance is
+       still available (computed from U), and setting it sets U."""
+    @property
+    def covariance(self):
+        return dot(self.factor.T, self.factor)[::-1, ::-1]
+
+    @covariance.setter
+    def covariance(self, covariance):
+        self.factor = covariance_factor(asarray(covariance)[::-1, ::-1])
+
+    def factor_columns(self, index):
+        """Returns the two columns of U which belong to the state variables
+           index and index + 1 (e.g. 0 for the robot's x, y), in this
+           order."""
+        n = len(self.state)
+        return self.factor[:, [n - 1 - index, n - 2 - index]]
+
+    @staticmethod
+    def get_error_ellipse(columns):
+        """Same as ExtendedKalmanFilterSLAM.get_error_ellipse, but computed
+           from the two columns of the factor which belong to a position
+           (see factor_columns), instead of the covariance. Their singular
+           values are the standard deviations, and the right singular
+           vectors are the axes."""
+        u, s, vt = linalg.svd(columns)
+        angle = atan2(vt[0, 1], vt[0, 0])
+        return (angle, s[0], s[1])
+
+    def get_landmark_error_ellipses(self):
+        """Returns a list of all error ellipses, one for each landmark."""
+        return [self.get_error_ellipse(self.factor_columns(3 + 2 * i))
+                for i in xrange(self.number_of_landmarks)]
+
+    def predict(self, control):
+        """The prediction step of the Kalman filter."""
+        G3 = self.dg_dstate(self.state, control, self.robot_width)
+        left, right = control
+        left_var = (self.control_motion_factor * left) ** 2 + \
+                   (self.control_turn_factor * (left - right)) ** 2
+        right_var = (self.control_motion_factor * right) ** 2 + \
+                    (self.control_turn_factor * (left - right)) ** 2
+        V = self.dg_dcontrol(self.state, control, self.robot_width)
+
+        # The robot's columns are the last three (in reverse order), so
+        # U GT only changes these columns, and U stays triangular except
+        # for its last three rows, which are only nonzero in these columns.
+        # Together with the two rows of the control noise, they are replaced
+        # by the triangular factor of their 5 x 3 block.
+        U = self.factor
+        U[:, -3:] = dot(U[:, -3:], G3[::-1, ::-1].T)
+        block = concatenate((U[-3:, -3:],
+                             sqrt([[left_var], [right_var]]) * V[::-1].T))
+        U[-3:, -3:] = linalg.qr(block, mode='r')
+        self.state = self.g(self.state, control, self.robot_width)
+
+    def add_landmark_to_state(self, initial_coords):
+        """Enlarge the current state and covariance factor to include one
+           more landmark, which is given by its initial_coords (an (x, y)
+           tuple). Returns the index of the newly added landmark."""
+        x, y = initial_coords
+        n = len(self.state)
+        self.state = concatenate((self.state, array([x, y])), axis=0)
+        # The new landmark comes first in the reverse order.
+        factor = zeros((n + 2, n + 2))
+        factor[0:2, 0:2] = eye(2) * sqrt(1e10)
+        factor[2:, 2:] = self.factor
+        self.factor = factor
+        if self.landmark_index is not None:
+            self.landmark_index.insert(self.number_of_landmarks, x, y)
+        self.number_of_landmarks += 1
+        return self.number_of_landmarks - 1
+
+    def correct(self, measurement, landmark_index):
+        """The correction step of the Kalman filter."""
+        landmark = self.state[3 + 2 * landmark_index: 3 + 2 * landmark_index + 2]
+        H3 = self.dh_dstate(self.state, landmark, self.scanner_displacement)
+        H = zeros((2, len(self.state)))
+        H[:, 0:3] = H3
+        H[:, 3 + 2 * landmark_index: 3 + 2 * landmark_index + 2] = -H3[:, :2]
+
+        innovation = array(measurement) - \
+                     self.h(self.state, landmark, self.scanner_displacement)
+        innovation[1] = (innovation[1] + pi) % (2 * pi) - pi
+        # Q is diagonal, so distance and bearing are processed one after
+        # the other. The second one is relative to the state which is
+        # already corrected by the first one. (The correction is in the
+        # reverse order, as U.)
+        variances = [self.measurement_distance_stddev ** 2,
+                     self.measurement_angle_stddev ** 2]
+        correction = zeros(len(self.state))
+        for h, residual, variance in zip(H[:, ::-1], innovation, variances):
+            step, self.factor = square_root_update(
+                self.factor, h, residual - dot(h, correction), variance)
+            correction += step
+        self.state = self.state + correction[::-1]
+        # The correction moves all landmarks, so update their grid cells.
+        if self.landmark_index is not None:
+            self.landmark_index.refresh(self.state)
+
+
+if __name__ == '__main__':
+    # Robot constants.
+    scanner_displacement = 30.0
+    ticks_to_mm = 0.349
+    robot_width = 155.0
+
+    # Cylinder extraction and matching constants.
+    minimum_valid_distance = 20.0
+    depth_jump = 100.0
+    cylinder_offset = 90.0
+    max_cylinder_distance = 500.0
+
+    # Filter constants.
+    control_motion_factor = 0.35  # Error in motor control.
+    control_turn_factor = 0.6  # Additional error due to slip when turning.
+    measurement_distance_stddev = 600.0  # Distance measurement error of cylinders.
+    measurement_angle_stddev = 45. / 180.0 * pi  # Angle measurement error.
+
+    # Arbitrary start position.
+    initial_state = array([500.0, 0.0, 45.0 / 180.0 * pi])
+
+    # Covariance at start position.
+    initial_covariance = zeros((3, 3))
+
+    # Read data.
+    logfile = LegoLogfile()
+    logfile.read("robot4_motors.txt")
+    logfile.read("robot4_scan.txt")
+
+    # Run the normal and the square-root filter, with the observations
+    # of the square-root filter, so that both get the same corrections and
+    # add the same landmarks.
+    kf = ExtendedKalmanFilterSLAM(initial_state.copy(), initial_covariance,
+                                  robot_width, scanner_displacement,
+                                  control_motion_factor, control_turn_factor,
+                                  measurement_distance_stddev,
+                                  measurement_angle_stddev,
+                                  landmark_cell_size = max_cylinder_distance)
+    sf = SquareRootExtendedKalmanFilterSLAM(
+        initial_state.copy(), initial_covariance,
+        robot_width, scanner_displacement,
+        control_motion_factor, control_turn_factor,
+        measurement_distance_stddev, measurement_angle_stddev,
+        landmark_cell_size = max_cylinder_distance)
+    times = {kf: 0.0, sf: 0.0}
+    max_state_difference = 0.0
+    max_stddev_difference = 0.0
+    max_asymmetry = 0.0
+    f = open("ekf_slam_square_root.txt", "w")
+    for i in xrange(len(logfile.motor_ticks)):
+        control = array(logfile.motor_ticks[i]) * ticks_to_mm
+        observations = get_observations(
+            logfile.scan_data[i],
+            depth_jump, minimum_valid_distance, cylinder_offset,
+            sf, max_cylinder_distance)
+        for filter in (kf, sf):
+            start = timeit.default_timer()
+            filter.predict(control)
+            for obs in observations:
+                measurement, cylinder_world, cylinder_scanner, cylinder_index = obs
+                if cylinder_index == -1:
+                    cylinder_index = filter.add_landmark_to_state(
+                        cylinder_world)
+                filter.correct(measurement, cylinder_index)
+            times[filter] += timeit.default_timer() - start
+
+        max_state_difference = max(max_state_difference,
+                                   abs(kf.state - sf.state).max())
+        max_stddev_difference = max(max_stddev_difference, abs(
+            sqrt(diag(kf.covariance)) - sqrt(diag(sf.covariance))).max())
+        max_asymmetry = max(max_asymmetry,
+                            abs(kf.covariance - kf.covariance.T).max())
+
+        # Output the center of the scanner, not the center of the robot.
+        print >> f, "F %f %f %f" % \
+                    tuple(sf.state[0:3] + [scanner_displacement * cos(sf.state[2]),
+                                           scanner_displacement * sin(sf.state[2]),
+                                           0.0])
+        e = SquareRootExtendedKalmanFilterSLAM.get_error_ellipse(
+            sf.factor_columns(0))
+        heading = sf.factor[:, -3]
+        print >> f, "E %f %f %f %f" % (e + (sqrt(dot(heading, heading)),))
+        write_cylinders(f, "W C", sf.get_landmarks())
+        write_error_ellipses(f, "W E", sf.get_landmark_error_ellipses())
+        write_cylinders(f, "D C", [(obs[2][0], obs[2][1])
+                                   for obs in observations])
+    f.close()
+
+    n = len(logfile.motor_ticks)
+    print "Landmarks: %d" % sf.number_of_landmarks
+    print "Time per step: normal %.3f ms, square root %.3f ms" % \
+        (times[kf] / n * 1000.0, times[sf] / n * 1000.0)
+    print "Max. difference of the state:", max_state_difference
+    print "Max. difference of the standard deviations:", \
+        max_stddev_difference
+    print "Max. asymmetry of the normal filter's covariance:", max_asymmetry
@@ -1,8 +1,14 @@
 # This file contains helper functions for Unit D of the SLAM lecture,
 # most of which were developed in earlier units.
 # Claus Brenner, 11 DEC 2012
-from math import sin, cos, pi
+from math import sin, cos, pi, floor
 from lego_robot import LegoLogfile
+import numpy as np
+
+# Chi-square value for 2 degrees of freedom (range, bearing) at 99%.
+# A predicted and an actual measurement whose squared Mahalanobis distance
+# is below this value are considered compatible.
+chi2_gate_2dof = 9.21
 
 # Utility to write a list of cylinders to (one line of) a given file.
 # Line header defines the start of each line, e.g. "D C" for a detected
@@ -59,6 +65,72 @@ def find_cylinders(scan, scan_derivative, jump, min_dist):
             rays += 1
     return cylinder_list
 
+# Uniform grid over the landmark estimates which are part of the EKF SLAM
+# state. Every landmark index is stored in the bucket of the grid cell which
+# contains its current (x, y) estimate, so that a gated nearest neighbour
+# query only has to look at the few cells overlapping the gate, instead of
+# at all landmarks. The grid does not store coordinates itself, it always
+# reads them from the state vector, which is laid out as
+# (x, y, theta, x_0, y_0, x_1, y_1, ...).
+class LandmarkIndex(object):
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        # Maps (cell_x, cell_y) to the list of landmark indices in that cell.
+        self.buckets = {}
+        # Cell of every landmark, row i belongs to landmark i.
+        self.landmark_cells = np.zeros((0, 2), dtype=int)
+
+    def __len__(self):
+        return len(self.landmark_cells)
+
+    def cell(self, x, y):
+        return (int(floor(x / self.cell_size)), int(floor(y / self.cell_size)))
+
+    def insert(self, index, x, y):
+        """Adds landmark number index (which must be the next free index,
+           as returned by add_landmark_to_state) at position (x, y)."""
+        assert index == len(self.landmark_cells)
+        c = self.cell(x, y)
+        self.buckets.setdefault(c, []).append(index)
+        self.landmark_cells = np.vstack((self.landmark_cells, [c]))
+
+    def refresh(self, state):
+        """Re-buckets all landmarks after their estimates in state have
+           changed, e.g. after a correction step. Only the landmarks which
+           actually moved to another cell are touched."""
+        n = len(self.landmark_cells)
+        if not n:
+            return
+        positions = np.asarray(state[3:3 + 2 * n]).reshape(n, 2)
+        new_cells = np.floor(positions / self.cell_size).astype(int)
+        moved = np.nonzero(np.any(new_cells != self.landmark_cells, axis=1))[0]
+        for index in moved:
+            old = tuple(self.landmark_cells[index])
+            bucket = self.buckets[old]
+            bucket.remove(index)
+            if not bucket:
+                del self.buckets[old]
+            self.buckets.setdefault(tuple(new_cells[index]), []).append(index)
+        self.landmark_cells = new_cells
+
+    def nearest(self, state, x, y, max_distance):
+        """Returns the index of the landmark in state which is closest to
+           (x, y) and closer than max_distance, or -1 if there is none."""
+        best_dist_2 = max_distance * max_distance
+        best_index = -1
+        cx0, cy0 = self.cell(x - max_distance, y - max_distance)
+        cx1, cy1 = self.cell(x + max_distance, y + max_distance)
+        for cx in xrange(cx0, cx1 + 1):
+            for cy in xrange(cy0, cy1 + 1):
+                for index in self.buckets.get((cx, cy), ()):
+                    dx = state[3 + 2 * index] - x
+                    dy = state[3 + 2 * index + 1] - y
+                    dist_2 = dx * dx + dy * dy
+                    if dist_2 < best_dist_2:
+                        best_dist_2 = dist_2
+                        best_index = index
+        return best_index
+
 # This function does all processing needed to obtain the cylinder observations.
 # It matches the cylinders and returns distance and angle observations together
 # with the cylinder coordinates in the world system, the scanner
@@ -78,6 +150,8 @@ def find_cylinders(scan, scan_derivative, jump, min_dist):
 #   and the index of the matched cylinder are added to the output list.
 #   The index is the cylinder number in the robot's current state.
 # - If there is no matching cylinder, the returned index will be -1.
+# If the robot maintains a LandmarkIndex (as robot.landmark_index), it is
+# used for the closest cylinder search instead of looping over all landmarks.
 def get_observations(scan, jump, min_dist, cylinder_offset,
                      robot,
                      max_cylinder_distance):
@@ -92,6 +166,7 @@ def get_observations(scan, jump, min_dist, cylinder_offset,
     # For every detected cylinder which has a closest matching pole in the
     # cylinders that are part of the current state, put the measurement
     # (distance, angle) and the corresponding cylinder index into the result list.
+    landmark_index = getattr(robot, 'landmark_index', None)
     result = []
     for c in cylinders:
         # Compute the angle and distance measurements.
@@ -101,16 +176,310 @@ def get_observations(scan, jump, min_dist, cylinder_offset,
         xs, ys = distance*cos(angle), distance*sin(angle)
         x, y = LegoLogfile.scanner_to_world(scanner_pose, (xs, ys))
         # Find closest cylinder in the state.
-        best_dist_2 = max_cylinder_distance * max_cylinder_distance
-        best_index = -1
-        for index in xrange(robot.number_of_landmarks):
-            pole_x, pole_y = robot.state[3+2*index : 3+2*index+2]
-            dx, dy = pole_x - x, pole_y - y
-            dist_2 = dx * dx + dy * dy
-            if dist_2 < best_dist_2:
-                best_dist_2 = dist_2
-                best_index = index
+        if landmark_index is not None:
+            best_index = landmark_index.nearest(
+                robot.state, x, y, max_cylinder_distance)
+        else:
+            best_dist_2 = max_cylinder_distance * max_cylinder_distance
+            best_index = -1
+            for index in xrange(robot.number_of_landmarks):
+                pole_x, pole_y = robot.state[3+2*index : 3+2*index+2]
+                dx, dy = pole_x - x, pole_y - y
+                dist_2 = dx * dx + dy * dy
+                if dist_2 < best_dist_2:
+                    best_dist_2 = dist_2
+                    best_index = index
         # Always add result to list. Note best_index may be -1.
         result.append(((distance, angle), (x, y), (xs, ys), best_index))
 
     return result
+
+# Vectorized version of the filter's h and dh_dstate, for many landmarks.
+# Takes a (x, y, theta) state and a list of m (x, y) landmarks and returns
+# an (m, 2) array of predicted (range, bearing) measurements and the
+# (m, 2, 3) array of their derivatives with respect to the robot's pose.
+# (The derivative with respect to the landmark is minus the first two
+# columns of the latter.)
+def predict_measurements(state, landmarks, scanner_displacement):
+    landmarks = np.asarray(landmarks, dtype=float).reshape(-1, 2)
+    theta = state[2]
+    cost, sint = cos(theta), sin(theta)
+    dx = landmarks[:, 0] - (state[0] + scanner_displacement * cost)
+    dy = landmarks[:, 1] - (state[1] + scanner_displacement * sint)
+    q = dx * dx + dy * dy
+    sqrtq = np.sqrt(q)
+
+    z = np.empty((len(landmarks), 2))
+    z[:, 0] = sqrtq
+    z[:, 1] = (np.arctan2(dy, dx) - theta + pi) % (2 * pi) - pi
+
+    H = np.empty((len(landmarks), 2, 3))
+    H[:, 0, 0] = -dx / sqrtq
+    H[:, 0, 1] = -dy / sqrtq
+    H[:, 0, 2] = (dx * sint - dy * cost) * scanner_displacement / sqrtq
+    H[:, 1, 0] = dy / q
+    H[:, 1, 1] = -dx / q
+    H[:, 1, 2] = -1 - scanner_displacement / q * (dx * cost + dy * sint)
+    return z, H
+
+# Returns an (m, 5) array which contains, for each of m landmarks, the
+# indices of the state entries (x, y, theta, x_i, y_i) a measurement of
+# landmark i depends on.
+def landmark_state_indices(m):
+    idx = np.empty((m, 5), dtype=int)
+    idx[:, 0:3] = [0, 1, 2]
+    idx[:, 3] = 3 + 2 * np.arange(m)
+    idx[:, 4] = idx[:, 3] + 1
+    return idx
+
+# For all landmarks of an EKF SLAM robot, returns the predicted measurements
+# z (m, 2), the nonzero part of the measurement Jacobians (m, 2, 5), which
+# belong to the state entries given by landmark_state_indices, and the
+# innovation covariances S = H P H^T + Q (m, 2, 2).
+def predict_landmark_measurements(robot):
+    m = robot.number_of_landmarks
+    landmarks = robot.state[3:3 + 2 * m].reshape(m, 2)
+    z, H3 = predict_measurements(robot.state, landmarks,
+                                 robot.scanner_displacement)
+    J = np.concatenate((H3, -H3[:, :, 0:2]), axis=2)
+    idx = landmark_state_indices(m)
+    P = robot.covariance[idx[:, :, np.newaxis], idx[:, np.newaxis, :]]
+    Q = np.diag([robot.measurement_distance_stddev ** 2,
+                 robot.measurement_angle_stddev ** 2])
+    S = np.einsum('mij,mjk,mlk->mil', J, P, J) + Q
+    return z, J, S
+
+# Squared Mahalanobis distances between k measurements, given as (k, 2)
+# array of (range, bearing), and m predicted measurements z (m, 2) with
+# innovation covariances S (m, 2, 2). Returns a (k, m) array.
+def mahalanobis_distances(measurements, z, S):
+    innovation = measurements[:, np.newaxis, :] - z[np.newaxis, :, :]
+    innovation[:, :, 1] = (innovation[:, :, 1] + pi) % (2 * pi) - pi
+    # Explicit inverse of all 2x2 matrices at once.
+    a, b, c, d = S[:, 0, 0], S[:, 0, 1], S[:, 1, 0], S[:, 1, 1]
+    det = a * d - b * c
+    u, v = innovation[:, :, 0], innovation[:, :, 1]
+    return (d * u * u - (b + c) * u * v + a * v * v) / det
+
+# Like get_observations, but instead of using a fixed radius around the
+# detected cylinder, every detection is compared to every landmark of the
+# state in measurement space, using predict_landmark_measurements.
+# Each detection is assigned the landmark with the smallest Mahalanobis
+# distance, if this is below gate. If it is above new_landmark_gate (which
+# defaults to gate), the returned index is -1, i.e. it is a new landmark.
+# Detections in between are ambiguous and are not returned at all, so they
+# neither cause a correction step nor a duplicate landmark.
+def get_observations_gated(scan, jump, min_dist, cylinder_offset,
+                           robot,
+                           gate = chi2_gate_2dof, new_landmark_gate = None):
+    if new_landmark_gate is None:
+        new_landmark_gate = gate
+    der = compute_derivative(scan, min_dist)
+    cylinders = find_cylinders(scan, der, jump, min_dist)
+    if not cylinders:
+        return []
+    # Compute scanner pose from robot pose.
+    scanner_pose = (
+        robot.state[0] + cos(robot.state[2]) * robot.scanner_displacement,
+        robot.state[1] + sin(robot.state[2]) * robot.scanner_displacement,
+        robot.state[2])
+
+    # The (distance, angle) measurements of all cylinders.
+    measurements = np.array(
+        [(c[1] + cylinder_offset, LegoLogfile.beam_index_to_angle(c[0]))
+         for c in cylinders])
+
+    if robot.number_of_landmarks:
+        z, J, S = predict_landmark_measurements(robot)
+        d2 = mahalanobis_distances(measurements, z, S)
+        best = np.argmin(d2, axis=1)
+        best_d2 = d2[np.arange(len(cylinders)), best]
+    else:
+        best = -np.ones(len(cylinders), dtype=int)
+        best_d2 = np.inf * np.ones(len(cylinders))
+
+    result = []
+    for i in xrange(len(cylinders)):
+        distance, angle = measurements[i]
+        xs, ys = distance*cos(angle), distance*sin(angle)
+        x, y = LegoLogfile.scanner_to_world(scanner_pose, (xs, ys))
+        if best_d2[i] < gate:
+            best_index = int(best[i])
+        elif best_d2[i] >= new_landmark_gate:
+            best_index = -1
+        else:
+            continue
+        result.append(((distance, angle), (x, y), (xs, ys), best_index))
+
+    return result
+
+# Joint compatibility branch and bound (JCBB) data association.
+# measurements is a (k, 2) array of (range, bearing). Searches for the
+# assignment of detections to landmarks of the robot's state with the
+# largest number of pairings, such that all pairings are jointly compatible,
+# i.e. the squared Mahalanobis distance of the stacked innovation, using the
+# full joint covariance H P H^T + Q, is below the chi-square value for 2p
+# degrees of freedom (p being the number of pairings).
+# - Only individually compatible pairs are considered as candidates, which
+#   keeps the search tree small.
+# - The joint Mahalanobis distance is updated incrementally, using the
+#   inverse of the joint covariance of the parent hypothesis (block
+#   inversion with the 2x2 Schur complement), so each node costs O(p^2).
+# - A branch is not followed if it can not result in more pairings than the
+#   best hypothesis found so far. Since candidates are tried closest first,
+#   among hypotheses with the same number of pairings the first one found
+#   is kept.
+# Returns the list of assigned landmark indices (-1 for unpaired detections)
+# and the array of the individual squared Mahalanobis distances of each
+# detection to its closest landmark.
+def associate_jcbb(robot, measurements, probability = 0.99):
+    # Only JCBB needs scipy, so it is imported here.
+    from scipy.stats import chi2
+    k = len(measurements)
+    m = robot.number_of_landmarks
+    if not k or not m:
+        return [-1] * k, np.inf * np.ones(k)
+
+    z, J, S = predict_landmark_measurements(robot)
+    idx = landmark_state_indices(m)
+    d2 = mahalanobis_distances(measurements, z, S)
+    closest_d2 = d2.min(axis=1)
+
+    # Individually compatible candidates of each detection, closest first.
+    ic_gate = chi2.ppf(probability, 2)
+    candidates = [[j for j in np.argsort(d2[i]) if d2[i, j] < ic_gate]
+                  for i in xrange(k)]
+    # Maximum number of pairings still possible from detection i on.
+    remaining = np.cumsum([bool(c) for c in candidates][::-1])[::-1]
+    remaining = np.append(remaining, 0)
+    jc_gates = chi2.ppf(probability, 2 * np.arange(1, k + 1))
+
+    # Innovations of all pairs, and P H^T (N, 2) for all candidate landmarks.
+    innovations = measurements[:, np.newaxis, :] - z[np.newaxis, :, :]
+    innovations[:, :, 1] = (innovations[:, :, 1] + pi) % (2 * pi) - pi
+    candidate_landmarks = sorted(set(j for c in candidates for j in c))
+    PHt = {}
+    if candidate_landmarks:
+        c = np.array(candidate_landmarks)
+        PHt_c = np.einsum('nmk,mjk->mnj', robot.covariance[:, idx[c]], J[c])
+        PHt = dict(zip(candidate_landmarks, PHt_c))
+
+    best = {'assignment': [-1] * k, 'pairings': 0}
+    assignment = [-1] * k
+    used = set()
+
+    def search(i, pairs, nu, C_inv, joint_d2):
+        if len(pairs) + remaining[i] <= best['pairings']:
+            return
+        if i == k:
+            best['assignment'] = assignment[:]
+            best['pairings'] = len(pairs)
+            return
+        for j in candidates[i]:
+            if j in used:
+                continue
+            # Cross covariance of the new pair with all previous pairs.
+            B = np.zeros((2 * len(pairs), 2))
+            for p, jp in enumerate(pairs):
+                B[2*p:2*p+2] = np.dot(J[jp], PHt[j][idx[jp]])
+            C_inv_B = np.dot(C_inv, B)
+            schur = S[j] - np.dot(B.T, C_inv_B)
+            schur_inv = np.array([[schur[1, 1], -schur[0, 1]],
+                                  [-schur[1, 0], schur[0, 0]]]) / \
+                (schur[0, 0] * schur[1, 1] - schur[0, 1] * schur[1, 0])
+            w = innovations[i, j] - np.dot(C_inv_B.T, nu)
+            new_d2 = joint_d2 + np.dot(w, np.dot(schur_inv, w))
+            if new_d2 >= jc_gates[len(pairs)]:
+                continue
+            # Jointly compatible, so extend the hypothesis.
+            n = 2 * len(pairs)
+            new_C_inv = np.empty((n + 2, n + 2))
+            tmp = np.dot(C_inv_B, schur_inv)
+            new_C_inv[:n, :n] = C_inv + np.dot(tmp, C_inv_B.T)
+            new_C_inv[:n, n:] = -tmp
+            new_C_inv[n:, :n] = -tmp.T
+            new_C_inv[n:, n:] = schur_inv
+            assignment[i] = j
+            used.add(j)
+            search(i + 1, pairs + [j],
+                   np.concatenate((nu, innovations[i, j])),
+                   new_C_inv, new_d2)
+            used.discard(j)
+            assignment[i] = -1
+        # Leave detection i unpaired, if this can still improve.
+        if len(pairs) + remaining[i + 1] > best['pairings']:
+            search(i + 1, pairs, nu, C_inv, joint_d2)
+
+    search(0, [], np.zeros(0), np.zeros((0, 0)), 0.0)
+    return [int(j) for j in best['assignment']], closest_d2
+
+# Like get_observations_gated, but uses associate_jcbb to assign all
+# detections of the scan jointly. Unpaired detections become new landmarks
+# (index -1) if their squared Mahalanobis distance to all landmarks is at
+# least new_landmark_gate, otherwise they are not returned.
+def get_observations_jcbb(scan, jump, min_dist, cylinder_offset,
+                          robot,
+                          probability = 0.99, new_landmark_gate = None):
+    if new_landmark_gate is None:
+        from scipy.stats import chi2
+        new_landmark_gate = chi2.ppf(probability, 2)
+    der = compute_derivative(scan, min_dist)
+    cylinders = find_cylinders(scan, der, jump, min_dist)
+    if not cylinders:
+        return []
+    # Compute scanner pose from robot pose.
+    scanner_pose = (
+        robot.state[0] + cos(robot.state[2]) * robot.scanner_displacement,
+        robot.state[1] + sin(robot.state[2]) * robot.scanner_displacement,
+        robot.state[2])
+
+    # The (distance, angle) measurements of all cylinders.
+    measurements = np.array(
+        [(c[1] + cylinder_offset, LegoLogfile.beam_index_to_angle(c[0]))
+         for c in cylinders])
+    assignment, closest_d2 = associate_jcbb(robot, measurements, probability)
+
+    result = []
+    for i in xrange(len(cylinders)):
+        distance, angle = measurements[i]
+        xs, ys = distance*cos(angle), distance*sin(angle)
+        x, y = LegoLogfile.scanner_to_world(scanner_pose, (xs, ys))
+        if assignment[i] == -1 and closest_d2[i] < new_landmark_gate:
+            continue
+        result.append(((distance, angle), (x, y), (xs, ys), assignment[i]))
+
+    return result
+
+# Helpers for square-root Kalman filters, which keep an upper triangular
+# factor U of the covariance P = UT U instead of P.
+# Returns such a U for the given covariance. Unlike the Cholesky
+# decomposition, this also works for a covariance which is only positive
+# semidefinite (e.g. all zero).
+def covariance_factor(covariance):
+    eigenvals, eigenvects = np.linalg.eigh(covariance)
+    A = np.sqrt(np.maximum(eigenvals, 0.0))[:, np.newaxis] * eigenvects.T
+    return np.linalg.qr(A, mode='r')
+
+# The square-root correction step for a single measurement. factor is U of
+# the current covariance, h the (n) derivative of the measurement,
+# innovation its difference to the predicted measurement, and variance its
+# variance. Returns the state correction K innovation and the factor of the
+# corrected covariance. (Measurements with a diagonal Q can be processed
+# one after the other.)
+# With y = U h and s = yT y + variance, the corrected covariance is
+# UT (I - y yT / s) U, and the Cholesky factor of I - y yT / s is known in
+# closed form. With c[k] = variance + sum of y[j]^2 for j >= k (so
+# c[0] = s), row k of the new factor is
+# sqrt(c[k+1] / c[k]) (U[k] - y[k] / c[k+1] * sum of y[j] U[j] for j > k),
+# which is upper triangular again. This takes O(n^2), instead of the O(n^3)
+# of a QR decomposition of the pre-array.
+def square_root_update(factor, h, innovation, variance):
+    y = np.dot(factor, h)
+    c = np.append(np.cumsum((y * y)[::-1])[::-1], 0.0) + variance
+    rows = y[:, np.newaxis] * factor
+    tail = np.zeros_like(factor)
+    np.cumsum(rows[:0:-1], axis=0, out=tail[-2::-1])
+    correction = np.dot(factor.T, y) * (innovation / c[0])
+    factor = np.sqrt(c[1:] / c[:-1])[:, np.newaxis] * \
+             (factor - (y / c[1:])[:, np.newaxis] * tail)
+    return correction, factor